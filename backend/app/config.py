@@ -63,6 +63,10 @@ class Settings(BaseSettings):
     password_min_length: int = Field(default=8, description="Minimum password length")
     max_login_attempts: int = Field(default=5, description="Maximum login attempts")
     lockout_duration_minutes: int = Field(default=30, description="Lockout duration in minutes")
+    password_hash_workers: int = Field(
+        default=min(4, os.cpu_count() or 1),
+        description="Password hashing worker processes (each argon2 hash uses 64 MiB)"
+    )
     
     class Config:
         env_file = ".env"
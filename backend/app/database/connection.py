@@ -1,11 +1,12 @@
 """
 Database connection module
-Handles MongoDB connection using Motor (async MongoDB driver)
+Handles MongoDB connection using the PyMongo async API
 """
 
 import logging
 from typing import Optional
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import AsyncMongoClient
+from pymongo.asynchronous.database import AsyncDatabase
 from pymongo.errors import ServerSelectionTimeoutError
 import certifi
 
@@ -17,13 +18,13 @@ class Database:
     """Database connection manager"""
     
     def __init__(self):
-        self.client: Optional["AsyncIOMotorClient"] = None
-        self.database: Optional["AsyncIOMotorDatabase"] = None
+        self.client: Optional["AsyncMongoClient"] = None
+        self.database: Optional["AsyncDatabase"] = None
         
     async def connect(self) -> None:
         """Connect to MongoDB"""
         try:
-            self.client = AsyncIOMotorClient(
+            self.client = AsyncMongoClient(
                 settings.mongodb_url,
                 tls=True,
                 tlsCAFile=certifi.where(),
@@ -51,7 +52,7 @@ class Database:
     async def disconnect(self) -> None:
         """Disconnect from MongoDB"""
         if self.client:
-            self.client.close()
+            await self.client.close()
             logger.info("📤 Disconnected from MongoDB")
     
     async def _create_indexes(self) -> None:
@@ -61,12 +62,13 @@ class Database:
             await self.database.users.create_index("email", unique=True)
             await self.database.users.create_index("username", unique=True)
             await self.database.users.create_index([("created_at", -1)])
+            await self.database.users.create_index([("role", 1), ("status", 1)])
             
             # Tickets collection indexes
             await self.database.tickets.create_index([("created_at", -1)])
             await self.database.tickets.create_index("status")
             await self.database.tickets.create_index("priority")
-            await self.database.tickets.create_index("assigned_to")
+            await self.database.tickets.create_index([("assigned_to", 1), ("status", 1)])
             await self.database.tickets.create_index("created_by")
             await self.database.tickets.create_index([("title", "text"), ("description", "text")])
             
@@ -77,7 +79,9 @@ class Database:
             
             # Notifications collection indexes
             await self.database.notifications.create_index([("created_at", -1)])
-            await self.database.notifications.create_index("user_id")
+            await self.database.notifications.create_index([("user_id", 1), ("created_at", -1)])
+            await self.database.notifications.create_index([("user_id", 1), ("is_read", 1), ("created_at", -1)])
+            await self.database.notifications.create_index([("user_id", 1), ("notification_type", 1)])
             await self.database.notifications.create_index("is_read")
             
             logger.info("📊 Database indexes created successfully")
@@ -96,7 +100,7 @@ async def close_database() -> None:
     """Close database connection"""
     await db.disconnect()
 
-def get_database() -> AsyncIOMotorDatabase:
+def get_database() -> AsyncDatabase:
     """Get database instance"""
     if db.database is None:
         raise RuntimeError("Database not initialized. Call init_database() first.")
@@ -68,6 +68,21 @@ class NotificationResponse(BaseModel):
         json_encoders = {ObjectId: str}
 
 
+class NotificationPush(BaseModel):
+    """Slim notification payload pushed over WebSocket"""
+    id: PyObjectId = Field(alias="_id")
+    title: str
+    message: str
+    notification_type: NotificationType
+    priority: NotificationPriority
+    ticket_id: Optional[PyObjectId] = None
+    created_at: datetime
+    
+    class Config:
+        populate_by_name = True
+        json_encoders = {ObjectId: str}
+
+
 class NotificationUserInfo(BaseModel):
     """User information for notification responses"""
     id: str
@@ -2,7 +2,6 @@
 Admin routes for system management and user administration
 """
 
-import math
 from datetime import datetime
 from typing import List, Optional
 from fastapi import APIRouter, HTTPException, status, Depends, Query
@@ -11,8 +10,9 @@ from bson import ObjectId
 from app.database.connection import get_database
 from app.models.user import UserResponse, UserUpdate, UserRole, UserStatus, UserProfile
 from app.models.ticket import TicketStats, TicketSummary, PaginatedTickets, TicketStatus, TicketResponse, TicketCreate
-from app.utils.auth import get_admin_user
-from app.services.notification_service import notification_service
+from app.utils.auth import get_admin_user, invalidate_user_cache
+from app.services.notification_service import notification_service, invalidate_admin_ids_cache
+from app.services.ticket_stats_cache import invalidate_stats_cache
 
 router = APIRouter()
 
@@ -115,6 +115,8 @@ async def update_user_by_admin(
         {"_id": ObjectId(user_id)},
         {"$set": update_data}
     )
+    invalidate_user_cache(user_id)
+    invalidate_admin_ids_cache()
     
     # Return updated user
     updated_user = await db.users.find_one({"_id": ObjectId(user_id)})
@@ -145,6 +147,8 @@ async def update_user_role(
             }
         }
     )
+    invalidate_user_cache(user_id)
+    invalidate_admin_ids_cache()
     
     if result.matched_count == 0:
         raise HTTPException(
@@ -179,6 +183,8 @@ async def update_user_status(
             }
         }
     )
+    invalidate_user_cache(user_id)
+    invalidate_admin_ids_cache()
     
     if result.matched_count == 0:
         raise HTTPException(
@@ -211,6 +217,8 @@ async def delete_user(
     db = get_database()
     
     result = await db.users.delete_one({"_id": ObjectId(user_id)})
+    invalidate_user_cache(user_id)
+    invalidate_admin_ids_cache()
     
     if result.deleted_count == 0:
         raise HTTPException(
@@ -285,7 +293,7 @@ async def get_all_tickets_admin(
     # Calculate pagination
     skip = (page - 1) * per_page
     total = await db.tickets.count_documents({})
-    pages = math.ceil(total / per_page)
+    pages = (total + per_page - 1) // per_page
     
     # Get tickets with user data
     pipeline = [
@@ -310,7 +318,7 @@ async def get_all_tickets_admin(
         }
     ]
     
-    tickets_cursor = db.tickets.aggregate(pipeline)
+    tickets_cursor = await db.tickets.aggregate(pipeline)
     tickets = []
     
     async for ticket in tickets_cursor:
@@ -373,7 +381,6 @@ async def create_ticket_for_user(
     """Create a new support ticket on behalf of a user (admin only)"""
     from app.models.ticket import TicketStatus, TicketResponse
     from app.models.user import UserProfile
-    from app.services.notification_service import notification_service
     
     if not ObjectId.is_valid(user_id):
         raise HTTPException(
@@ -408,6 +415,7 @@ async def create_ticket_for_user(
     })
     
     result = await db.tickets.insert_one(ticket_dict)
+    invalidate_stats_cache()
     created_ticket = await db.tickets.find_one({"_id": result.inserted_id})
     
     # Get target user profile for response
@@ -10,11 +10,12 @@ from bson import ObjectId
 from app.config import settings
 from app.database.connection import get_database
 from app.models.user import (
-    UserCreate, UserLogin, UserResponse, Token, PasswordChange, UserUpdate
+    UserCreate, UserLogin, UserResponse, Token, PasswordChange, UserUpdate, UserRole
 )
+from app.services.notification_service import invalidate_admin_ids_cache
 from app.utils.auth import (
     verify_password, get_password_hash, create_access_token,
-    get_current_active_user
+    get_current_active_user, invalidate_user_cache, user_token_claims, password_needs_rehash
 )
 
 router = APIRouter()
@@ -46,7 +47,7 @@ async def register_user(user_data: UserCreate):
             )
     
     # Hash password and create user
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash(user_data.password)
     
     user_dict = user_data.dict()
     user_dict.pop("password")
@@ -59,6 +60,8 @@ async def register_user(user_data: UserCreate):
     })
     
     result = await db.users.insert_one(user_dict)
+    if user_data.role != UserRole.CUSTOMER:
+        invalidate_admin_ids_cache()
     created_user = await db.users.find_one({"_id": result.inserted_id})
     
     return UserResponse(**created_user)
@@ -72,7 +75,7 @@ async def login_user(user_credentials: UserLogin):
     # Find user by email
     user = await db.users.find_one({"email": user_credentials.email})
     
-    if not user or not verify_password(user_credentials.password, user.get("password_hash", "")):
+    if not user or not await verify_password(user_credentials.password, user.get("password_hash", "")):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -89,14 +92,17 @@ async def login_user(user_credentials: UserLogin):
     # Create access token
     access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
     access_token = create_access_token(
-        data={"sub": str(user["_id"]), "email": user["email"]},
+        data=user_token_claims(user),
         expires_delta=access_token_expires
     )
     
-    # Update last login
+    # Update last login, upgrading legacy bcrypt hashes to argon2 in the same write
+    login_update = {"last_login": datetime.utcnow()}
+    if password_needs_rehash(user["password_hash"]):
+        login_update["password_hash"] = await get_password_hash(user_credentials.password)
     await db.users.update_one(
         {"_id": user["_id"]},
-        {"$set": {"last_login": datetime.utcnow()}}
+        {"$set": login_update}
     )
     
     # Get updated user data
@@ -137,6 +143,7 @@ async def update_current_user(
         {"_id": ObjectId(current_user.id)},
         {"$set": update_data}
     )
+    invalidate_user_cache(current_user.id)
     
     # Return updated user
     updated_user = await db.users.find_one({"_id": ObjectId(current_user.id)})
@@ -155,14 +162,14 @@ async def change_password(
     user = await db.users.find_one({"_id": ObjectId(current_user.id)})
     
     # Verify current password
-    if not verify_password(password_data.current_password, user.get("password_hash", "")):
+    if not await verify_password(password_data.current_password, user.get("password_hash", "")):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Current password is incorrect"
         )
     
     # Hash new password and update
-    new_password_hash = get_password_hash(password_data.new_password)
+    new_password_hash = await get_password_hash(password_data.new_password)
     
     await db.users.update_one(
         {"_id": ObjectId(current_user.id)},
@@ -173,5 +180,6 @@ async def change_password(
             }
         }
     )
+    invalidate_user_cache(current_user.id)
     
     return {"message": "Password changed successfully"} 
\ No newline at end of file
@@ -2,7 +2,6 @@
 Chat and messaging routes for ticket conversations
 """
 
-import math
 from datetime import datetime
 from fastapi import APIRouter, HTTPException, status, Depends, Query
 from bson import ObjectId
@@ -110,7 +109,7 @@ async def get_ticket_messages(
     
     # Calculate pagination
     skip = (page - 1) * per_page
-    pages = math.ceil(total / per_page)
+    pages = (total + per_page - 1) // per_page
     
     # Get messages with sender info
     pipeline = [
@@ -128,7 +127,7 @@ async def get_ticket_messages(
         }
     ]
     
-    messages_cursor = db.messages.aggregate(pipeline)
+    messages_cursor = await db.messages.aggregate(pipeline)
     messages = []
     
     async for message in messages_cursor:
@@ -198,7 +197,7 @@ async def get_ticket_conversation(
         }
     ]
     
-    messages_cursor = db.messages.aggregate(pipeline)
+    messages_cursor = await db.messages.aggregate(pipeline)
     messages = []
     participants_set = set()
     last_activity = None
@@ -2,7 +2,6 @@
 Notification routes for user notifications management
 """
 
-import math
 from datetime import datetime, timedelta
 from typing import List, Optional
 from fastapi import APIRouter, HTTPException, status, Depends, Query
@@ -23,6 +22,7 @@ router = APIRouter()
 
 
 @router.get("/", response_model=PaginatedNotifications)
+@router.get("", response_model=PaginatedNotifications, include_in_schema=False)
 async def get_notifications(
     page: int = Query(1, ge=1),
     per_page: int = Query(20, ge=1, le=100),
@@ -46,7 +46,7 @@ async def get_notifications(
     
     # Calculate pagination
     skip = (page - 1) * per_page
-    pages = math.ceil(total / per_page)
+    pages = (total + per_page - 1) // per_page
     
     # Get notifications
     notifications_cursor = db.notifications.find(query).sort("created_at", -1).skip(skip).limit(per_page)
@@ -124,7 +124,7 @@ async def get_notification_stats(current_user: UserResponse = Depends(get_curren
         {"$match": {"user_id": ObjectId(current_user.id)}},
         {"$group": {"_id": "$notification_type", "count": {"$sum": 1}}}
     ]
-    type_results = await db.notifications.aggregate(type_pipeline).to_list(None)
+    type_results = await (await db.notifications.aggregate(type_pipeline)).to_list(None)
     by_type = {result["_id"]: result["count"] for result in type_results}
     
     # Notifications by priority
@@ -132,7 +132,7 @@ async def get_notification_stats(current_user: UserResponse = Depends(get_curren
         {"$match": {"user_id": ObjectId(current_user.id)}},
         {"$group": {"_id": "$priority", "count": {"$sum": 1}}}
     ]
-    priority_results = await db.notifications.aggregate(priority_pipeline).to_list(None)
+    priority_results = await (await db.notifications.aggregate(priority_pipeline)).to_list(None)
     by_priority = {result["_id"]: result["count"] for result in priority_results}
     
     return NotificationStats(
@@ -384,7 +384,7 @@ async def get_all_notifications_admin(
     
     # Calculate pagination
     skip = (page - 1) * per_page
-    pages = math.ceil(total / per_page)
+    pages = (total + per_page - 1) // per_page
     
     # Get notifications with user info
     pipeline = [
@@ -402,7 +402,7 @@ async def get_all_notifications_admin(
         }
     ]
     
-    notifications_cursor = db.notifications.aggregate(pipeline)
+    notifications_cursor = await db.notifications.aggregate(pipeline)
     notifications = []
     
     async for notification in notifications_cursor:
@@ -478,7 +478,7 @@ async def create_system_notification(
     # Get users with target roles
     target_users = await db.users.find({
         "role": {"$in": target_roles},
-        "is_active": True
+        "status": "active"
     }).to_list(None)
     
     if not target_users:
@@ -538,7 +538,7 @@ async def get_system_notification_stats(
         {"$match": {"created_at": {"$gte": week_ago}}},
         {"$group": {"_id": "$priority", "count": {"$sum": 1}}}
     ]
-    priority_results = await db.notifications.aggregate(priority_pipeline).to_list(None)
+    priority_results = await (await db.notifications.aggregate(priority_pipeline)).to_list(None)
     notifications_by_priority = {result["_id"]: result["count"] for result in priority_results}
     
     # Notifications by type (last 7 days)
@@ -546,7 +546,7 @@ async def get_system_notification_stats(
         {"$match": {"created_at": {"$gte": week_ago}}},
         {"$group": {"_id": "$notification_type", "count": {"$sum": 1}}}
     ]
-    type_results = await db.notifications.aggregate(type_pipeline).to_list(None)
+    type_results = await (await db.notifications.aggregate(type_pipeline)).to_list(None)
     notifications_by_type = {result["_id"]: result["count"] for result in type_results}
     
     # Top users by notification count (last 7 days)
@@ -573,7 +573,7 @@ async def get_system_notification_stats(
         {"$sort": {"count": -1}},
         {"$limit": 10}
     ]
-    user_results = await db.notifications.aggregate(user_pipeline).to_list(None)
+    user_results = await (await db.notifications.aggregate(user_pipeline)).to_list(None)
     top_notification_recipients = [
         {
             "user_id": str(result["_id"]),
@@ -2,11 +2,11 @@
 Ticket management routes for CRUD operations
 """
 
-import math
 from datetime import datetime
 from typing import Optional
-from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi import APIRouter, BackgroundTasks, HTTPException, status, Depends, Query
 from bson import ObjectId
+from pymongo import ReturnDocument
 
 from app.config import settings
 from app.database.connection import get_database
@@ -18,13 +18,83 @@ from app.models.ticket import (
 )
 from app.utils.auth import get_current_active_user, get_agent_or_admin_user, check_ticket_permissions
 from app.services.notification_service import notification_service
+from app.services.ticket_stats_cache import (
+    cache_stats, get_cached_stats, invalidate_stats_cache, stats_lock, stats_version
+)
 
 router = APIRouter()
 
+# User fields embedded in ticket responses (_id is always returned by MongoDB)
+_PROFILE_FIELDS = ("username", "full_name", "role", "department", "avatar_url")
+# Built per joined user with $map so the plain localField lookup works on MongoDB < 5.0
+_PROFILE_SHAPE = {field: f"$$user.{field}" for field in ("_id", *_PROFILE_FIELDS)}
+_CURRENT_USER_PROFILE_FIELDS = {"id", *_PROFILE_FIELDS}
+
+# Raw/joined user references replaced by UserProfile objects in responses
+_USER_REF_FIELDS = frozenset(("created_by_user", "assigned_to_user", "created_by", "assigned_to"))
+
+def _user_lookup_stages(local_field: str, as_field: str) -> list:
+    """Build $lookup + $unwind stages that embed a single projected user profile"""
+    return [
+        {
+            "$lookup": {
+                "from": "users",
+                "localField": local_field,
+                "foreignField": "_id",
+                "as": as_field
+            }
+        },
+        {
+            "$addFields": {
+                as_field: {"$map": {"input": f"${as_field}", "as": "user", "in": _PROFILE_SHAPE}}
+            }
+        },
+        {"$unwind": {"path": f"${as_field}", "preserveNullAndEmptyArrays": True}}
+    ]
+
+
+async def _get_ticket_response(ticket_id: str) -> TicketResponse:
+    """Load a ticket with embedded user profiles (callers handle permission checks)"""
+    db = get_database()
+    
+    # Get ticket with user data
+    pipeline = [
+        {"$match": {"_id": ObjectId(ticket_id)}},
+        *_user_lookup_stages("created_by", "created_by_user"),
+        *_user_lookup_stages("assigned_to", "assigned_to_user")
+    ]
+    
+    result = await (await db.tickets.aggregate(pipeline)).to_list(1)
+    
+    if not result:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ticket not found"
+        )
+    
+    ticket = result[0]
+    
+    # Format user profiles
+    created_by_user = ticket.get("created_by_user")
+    assigned_to_user = ticket.get("assigned_to_user")
+    
+    created_by = UserProfile(**created_by_user) if created_by_user else None
+    assigned_to = UserProfile(**assigned_to_user) if assigned_to_user else None
+    
+    # Create ticket response data excluding user fields that need special formatting
+    ticket_data = {k: v for k, v in ticket.items() if k not in _USER_REF_FIELDS}
+    
+    # Add the properly formatted user profiles
+    ticket_data["created_by"] = created_by
+    ticket_data["assigned_to"] = assigned_to
+    
+    return TicketResponse(**ticket_data)
+
 
 @router.post("/", response_model=TicketResponse, status_code=status.HTTP_201_CREATED)
 async def create_ticket(
     ticket_data: TicketCreate,
+    background_tasks: BackgroundTasks,
     current_user: UserResponse = Depends(get_current_active_user)
 ):
     """Create a new support ticket"""
@@ -46,28 +116,18 @@ async def create_ticket(
     })
     
     result = await db.tickets.insert_one(ticket_dict)
-    created_ticket = await db.tickets.find_one({"_id": result.inserted_id})
-    
-    # Get user profile for response
-    user_profile = UserProfile(
-        _id=current_user.id,
-        username=current_user.username,
-        full_name=current_user.full_name,
-        role=current_user.role,
-        department=current_user.department,
-        avatar_url=current_user.avatar_url
-    )
+    ticket_dict["_id"] = result.inserted_id
+    invalidate_stats_cache()
     
-    # Prepare ticket response data with user profile
-    ticket_response_data = created_ticket.copy()
-    ticket_response_data.pop("created_by", None)  # Remove the ObjectId version
-    ticket_response_data["created_by"] = user_profile  # Add the UserProfile version
-    
-    # Format response
-    ticket_response = TicketResponse(**ticket_response_data)
+    # Reuse the already-validated current user and ticket data without re-validating;
+    # ticket_dict is local and already written, so swap in the UserProfile in place
+    ticket_dict["created_by"] = UserProfile.model_construct(
+        **current_user.model_dump(include=_CURRENT_USER_PROFILE_FIELDS)
+    )
+    ticket_response = TicketResponse.model_construct(**ticket_dict)
     
-    # Send real-time notifications to admins/agents about new ticket
-    await notification_service.notify_new_ticket(str(result.inserted_id))
+    # Send real-time notifications to admins/agents about new ticket after responding
+    background_tasks.add_task(notification_service.notify_new_ticket, str(result.inserted_id))
     
     return ticket_response
 
@@ -107,7 +167,7 @@ async def get_tickets(
     
     # Calculate pagination
     skip = (page - 1) * per_page
-    pages = math.ceil(total / per_page)
+    pages = (total + per_page - 1) // per_page
     
     # Get tickets with user data
     pipeline = [
@@ -115,52 +175,23 @@ async def get_tickets(
         {"$sort": {"created_at": -1}},
         {"$skip": skip},
         {"$limit": per_page},
-        {
-            "$lookup": {
-                "from": "users",
-                "localField": "created_by",
-                "foreignField": "_id",
-                "as": "created_by_user"
-            }
-        },
-        {
-            "$lookup": {
-                "from": "users",
-                "localField": "assigned_to",
-                "foreignField": "_id",
-                "as": "assigned_to_user"
-            }
-        }
+        *_user_lookup_stages("created_by", "created_by_user"),
+        *_user_lookup_stages("assigned_to", "assigned_to_user")
     ]
     
-    tickets_cursor = db.tickets.aggregate(pipeline)
+    tickets_cursor = await db.tickets.aggregate(pipeline)
     tickets = []
     
     async for ticket in tickets_cursor:
         # Format user profiles
-        created_by_user = ticket["created_by_user"][0] if ticket["created_by_user"] else None
-        assigned_to_user = ticket["assigned_to_user"][0] if ticket["assigned_to_user"] else None
-        
-        created_by = UserProfile(
-            _id=created_by_user["_id"],
-            username=created_by_user["username"],
-            full_name=created_by_user["full_name"],
-            role=created_by_user["role"],
-            department=created_by_user.get("department"),
-            avatar_url=created_by_user.get("avatar_url")
-        ) if created_by_user else None
+        created_by_user = ticket.get("created_by_user")
+        assigned_to_user = ticket.get("assigned_to_user")
         
-        assigned_to = UserProfile(
-            _id=assigned_to_user["_id"],
-            username=assigned_to_user["username"],
-            full_name=assigned_to_user["full_name"],
-            role=assigned_to_user["role"],
-            department=assigned_to_user.get("department"),
-            avatar_url=assigned_to_user.get("avatar_url")
-        ) if assigned_to_user else None
+        created_by = UserProfile(**created_by_user) if created_by_user else None
+        assigned_to = UserProfile(**assigned_to_user) if assigned_to_user else None
         
         # Create ticket summary data excluding user fields that need special formatting
-        ticket_data = {k: v for k, v in ticket.items() if k not in ["created_by_user", "assigned_to_user", "created_by", "assigned_to"]}
+        ticket_data = {k: v for k, v in ticket.items() if k not in _USER_REF_FIELDS}
         
         # Add the properly formatted user profiles
         ticket_data["created_by"] = created_by
@@ -201,62 +232,14 @@ async def get_ticket(
             detail="Not authorized to access this ticket"
         )
     
-    db = get_database()
-    
-    # Get ticket with user data
-    pipeline = [
-        {"$match": {"_id": ObjectId(ticket_id)}},
-        {
-            "$lookup": {
-                "from": "users",
-                "localField": "created_by",
-                "foreignField": "_id",
-                "as": "created_by_user"
-            }
-        },
-        {
-            "$lookup": {
-                "from": "users",
-                "localField": "assigned_to",
-                "foreignField": "_id",
-                "as": "assigned_to_user"
-            }
-        }
-    ]
-    
-    result = await db.tickets.aggregate(pipeline).to_list(1)
-    
-    if not result:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Ticket not found"
-        )
-    
-    ticket = result[0]
-    
-    # Format user profiles
-    created_by_user = ticket["created_by_user"][0] if ticket["created_by_user"] else None
-    assigned_to_user = ticket["assigned_to_user"][0] if ticket["assigned_to_user"] else None
-    
-    created_by = UserProfile(**created_by_user) if created_by_user else None
-    assigned_to = UserProfile(**assigned_to_user) if assigned_to_user else None
-    
-    # Create ticket response data excluding user fields that need special formatting
-    ticket_data = {k: v for k, v in ticket.items() if k not in ["created_by_user", "assigned_to_user", "created_by", "assigned_to"]}
-    
-    # Add the properly formatted user profiles
-    ticket_data["created_by"] = created_by
-    ticket_data["assigned_to"] = assigned_to
-    
-    ticket_response = TicketResponse(**ticket_data)
-    
-    return ticket_response
+    return await _get_ticket_response(ticket_id)
 
 
 @router.put("/{ticket_id}", response_model=TicketResponse)
 async def update_ticket(
     ticket_id: str,
     ticket_update: TicketUpdate,
+    background_tasks: BackgroundTasks,
     current_user: UserResponse = Depends(get_current_active_user)
 ):
     """Update a ticket"""
@@ -277,7 +260,7 @@ async def update_ticket(
     db = get_database()
     
     # Get original ticket for comparison
-    original_ticket = await db.tickets.find_one({"_id": ObjectId(ticket_id)})
+    original_ticket = await db.tickets.find_one({"_id": ObjectId(ticket_id)}, {"status": 1})
     if not original_ticket:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -288,7 +271,7 @@ async def update_ticket(
     update_data = {k: v for k, v in ticket_update.dict().items() if v is not None}
     
     if not update_data:
-        return await get_ticket(ticket_id, current_user)
+        return await _get_ticket_response(ticket_id)
     
     update_data["updated_at"] = datetime.utcnow()
     
@@ -311,31 +294,36 @@ async def update_ticket(
             detail="Ticket not found"
         )
     
-    # Send notifications for status changes
+    invalidate_stats_cache()
+    
+    # Send notifications for status changes after responding
     if new_status and old_status != new_status:
         if new_status == TicketStatus.RESOLVED:
             # Special notification for resolution
-            await notification_service.notify_ticket_resolved(
+            background_tasks.add_task(
+                notification_service.notify_ticket_resolved,
                 ticket_id, 
                 str(current_user.id),
                 update_data.get("resolution_note")
             )
         else:
             # General status change notification
-            await notification_service.notify_ticket_status_change(
+            background_tasks.add_task(
+                notification_service.notify_ticket_status_change,
                 ticket_id,
                 old_status,
                 new_status,
                 str(current_user.id)
             )
     
-    return await get_ticket(ticket_id, current_user)
+    return await _get_ticket_response(ticket_id)
 
 
 @router.post("/{ticket_id}/assign")
 async def assign_ticket(
     ticket_id: str,
     assignment: TicketAssign,
+    background_tasks: BackgroundTasks,
     current_user: UserResponse = Depends(get_agent_or_admin_user)
 ):
     """Assign ticket to an agent"""
@@ -347,24 +335,17 @@ async def assign_ticket(
     
     db = get_database()
     
-    # Verify ticket exists
-    ticket = await db.tickets.find_one({"_id": ObjectId(ticket_id)})
-    if not ticket:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Ticket not found"
-        )
-    
     # Verify assigned user exists and is an agent/admin
-    assigned_user = await db.users.find_one({"_id": ObjectId(assignment.assigned_to)})
+    assigned_user = await db.users.find_one({"_id": ObjectId(assignment.assigned_to)}, {"role": 1})
     if not assigned_user or assigned_user["role"] not in [UserRole.AGENT, UserRole.ADMIN]:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid user assignment"
         )
     
-    # Update ticket
-    await db.tickets.update_one(
+    # Update ticket; a missing pre-image means the ticket does not exist, and its
+    # status tells us whether this assignment moved it out of "open"
+    ticket = await db.tickets.find_one_and_update(
         {"_id": ObjectId(ticket_id)},
         {
             "$set": {
@@ -372,11 +353,21 @@ async def assign_ticket(
                 "status": TicketStatus.IN_PROGRESS,
                 "updated_at": datetime.utcnow()
             }
-        }
+        },
+        projection={"status": 1},
+        return_document=ReturnDocument.BEFORE
     )
+    if not ticket:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ticket not found"
+        )
+    
+    invalidate_stats_cache()
     
-    # Send notification to assigned user
-    await notification_service.notify_ticket_assignment(
+    # Send notification to assigned user after responding
+    background_tasks.add_task(
+        notification_service.notify_ticket_assignment,
         ticket_id,
         assignment.assigned_to,
         str(current_user.id)
@@ -384,7 +375,8 @@ async def assign_ticket(
     
     # Also send status change notification if ticket was open
     if ticket.get("status") == TicketStatus.OPEN:
-        await notification_service.notify_ticket_status_change(
+        background_tasks.add_task(
+            notification_service.notify_ticket_status_change,
             ticket_id,
             TicketStatus.OPEN.value,
             TicketStatus.IN_PROGRESS.value,
@@ -415,11 +407,30 @@ async def delete_ticket(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Ticket not found"
         )
+    
+    invalidate_stats_cache()
 
 
 @router.get("/stats/overview", response_model=TicketStats)
 async def get_ticket_stats(current_user: UserResponse = Depends(get_agent_or_admin_user)):
     """Get ticket statistics (admin/agent only)"""
+    stats = get_cached_stats()
+    if stats is not None:
+        return stats
+    
+    # Only one request recomputes; concurrent callers reuse its result
+    async with stats_lock:
+        stats = get_cached_stats()
+        if stats is None:
+            version = stats_version()
+            stats = await _compute_ticket_stats()
+            cache_stats(stats, version)
+    
+    return stats
+
+
+async def _compute_ticket_stats() -> TicketStats:
+    """Run the ticket statistics queries"""
     db = get_database()
     
     # Basic counts
@@ -435,24 +446,26 @@ async def get_ticket_stats(current_user: UserResponse = Depends(get_agent_or_adm
     category_pipeline = [
         {"$group": {"_id": "$category", "count": {"$sum": 1}}}
     ]
-    category_results = await db.tickets.aggregate(category_pipeline).to_list(None)
+    category_results = await (await db.tickets.aggregate(category_pipeline)).to_list(None)
     tickets_by_category = {result["_id"]: result["count"] for result in category_results}
     
-    # Tickets by agent
+    # Tickets by agent (group first so only one users lookup runs per distinct agent)
     agent_pipeline = [
         {"$match": {"assigned_to": {"$ne": None}}},
+        {"$group": {"_id": "$assigned_to", "count": {"$sum": 1}}},
         {
             "$lookup": {
                 "from": "users",
-                "localField": "assigned_to",
+                "localField": "_id",
                 "foreignField": "_id",
+                "pipeline": [{"$project": {"full_name": 1}}],
                 "as": "agent"
             }
         },
         {"$unwind": "$agent"},
-        {"$group": {"_id": "$agent.full_name", "count": {"$sum": 1}}}
+        {"$group": {"_id": "$agent.full_name", "count": {"$sum": "$count"}}}
     ]
-    agent_results = await db.tickets.aggregate(agent_pipeline).to_list(None)
+    agent_results = await (await db.tickets.aggregate(agent_pipeline)).to_list(None)
     tickets_by_agent = {result["_id"]: result["count"] for result in agent_results}
     
     return TicketStats(
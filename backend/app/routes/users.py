@@ -2,8 +2,8 @@
 User management routes
 """
 
-from typing import List
-from fastapi import APIRouter, HTTPException, status, Depends
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, status, Depends, Query
 from bson import ObjectId
 
 from app.database.connection import get_database
@@ -12,16 +12,35 @@ from app.utils.auth import get_current_active_user, get_agent_or_admin_user
 
 router = APIRouter()
 
+# Only the fields rendered by UserProfile (_id is always returned by MongoDB)
+_USER_PROFILE_PROJECTION = {
+    "username": 1,
+    "full_name": 1,
+    "role": 1,
+    "department": 1,
+    "avatar_url": 1
+}
+
 
 @router.get("/agents", response_model=List[UserProfile])
-async def get_agents(current_user: UserResponse = Depends(get_current_active_user)):
-    """Get list of all agents and admins"""
+async def get_agents(
+    page: Optional[int] = Query(None, ge=1),
+    per_page: Optional[int] = Query(None, ge=1, le=100),
+    current_user: UserResponse = Depends(get_current_active_user)
+):
+    """Get list of agents and admins (all of them unless page or per_page is given)"""
     db = get_database()
     
     agents_cursor = db.users.find({
         "role": {"$in": [UserRole.AGENT, UserRole.ADMIN]},
         "status": "active"
-    })
+    }, _USER_PROFILE_PROJECTION).sort("full_name", 1)
+    
+    # Calculate pagination only when the client asks for a page
+    if page is not None or per_page is not None:
+        page = page or 1
+        per_page = per_page or 100
+        agents_cursor = agents_cursor.skip((page - 1) * per_page).limit(per_page)
     
     agents = []
     async for user in agents_cursor:
@@ -43,7 +62,7 @@ async def get_user_profile(
         )
     
     db = get_database()
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, _USER_PROFILE_PROJECTION)
     
     if not user:
         raise HTTPException(
@@ -2,44 +2,90 @@
 Notification service for creating and broadcasting notifications
 """
 
+import asyncio
 import logging
+import time
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, Union
 from bson import ObjectId
 
 from app.database.connection import get_database
-from app.models.notification import NotificationType, NotificationCreate, NotificationResponse
+from app.models.notification import NotificationType, NotificationCreate, NotificationResponse, NotificationPush
 from app.models.user import UserRole
 from app.websocket.manager import manager
 
 logger = logging.getLogger(__name__)
 
+# Only the ticket/user fields the notification messages read
+_TICKET_PROJECTION = {"title": 1, "status": 1, "priority": 1, "created_by": 1, "assigned_to": 1}
+_USER_PROJECTION = {"full_name": 1, "username": 1, "email": 1}
+
+
+def _as_object_id(value: Union[str, ObjectId]) -> ObjectId:
+    """Return ``value`` as an ObjectId, only parsing it when given a string"""
+    return value if isinstance(value, ObjectId) else ObjectId(value)
+
+
+# Ids of active admins/agents for notify_all_admins, refreshed at most once per TTL
+_ADMIN_IDS_TTL_SECONDS = 60
+_admin_ids_cache: Optional[Tuple[float, List[str]]] = None
+
+
+async def _get_admin_ids() -> List[str]:
+    """Return the ids of active admins and agents, cached for a short TTL"""
+    global _admin_ids_cache
+    if _admin_ids_cache is not None:
+        cached_at, admin_ids = _admin_ids_cache
+        if time.monotonic() - cached_at <= _ADMIN_IDS_TTL_SECONDS:
+            return admin_ids
+    
+    db = get_database()
+    admin_users = await db.users.find({
+        "role": {"$in": ["admin", "agent"]},
+        "status": "active"
+    }, {"_id": 1}).to_list(None)
+    admin_ids = [str(user["_id"]) for user in admin_users]
+    _admin_ids_cache = (time.monotonic(), admin_ids)
+    return admin_ids
+
+
+def invalidate_admin_ids_cache() -> None:
+    """Drop the cached admin/agent ids after a user's role or status changes"""
+    global _admin_ids_cache
+    _admin_ids_cache = None
+
 
 class NotificationService:
     """Service for managing notifications and real-time broadcasting"""
     
     @staticmethod
     async def create_and_broadcast_notification(
-        user_id: str,
+        user_id: Union[str, ObjectId],
         notification_type: NotificationType,
         title: str,
         message: str,
         data: Optional[Dict[str, Any]] = None,
-        ticket_id: Optional[str] = None,
+        ticket_id: Optional[Union[str, ObjectId]] = None,
         priority: str = "medium"
     ) -> NotificationResponse:
-        """Create a notification and broadcast it via WebSocket"""
+        """Create a notification and broadcast it via WebSocket
+        
+        ``user_id`` and ``ticket_id`` may be given as ObjectIds to skip re-parsing.
+        """
         try:
             db = get_database()
+            user_oid = _as_object_id(user_id)
+            user_id = str(user_id)
             
-            # Create notification document
+            # Create notification document (id generated client-side so no read-back is needed)
             notification_data = {
-                "user_id": ObjectId(user_id),
+                "_id": ObjectId(),
+                "user_id": user_oid,
                 "notification_type": notification_type.value,
                 "title": title,
                 "message": message,
                 "data": data or {},
-                "ticket_id": ObjectId(ticket_id) if ticket_id else None,
+                "ticket_id": _as_object_id(ticket_id) if ticket_id else None,
                 "priority": priority,
                 "is_read": False,
                 "read_at": None,
@@ -48,27 +94,14 @@ class NotificationService:
             
             # Insert notification
             result = await db.notifications.insert_one(notification_data)
-            created_notification = await db.notifications.find_one({"_id": result.inserted_id})
             
-            # Convert ObjectIds to strings for proper serialization
-            notification_for_response = created_notification.copy()
-            notification_for_response["_id"] = str(created_notification["_id"])
-            notification_for_response["user_id"] = str(created_notification["user_id"])
-            if notification_for_response.get("ticket_id"):
-                notification_for_response["ticket_id"] = str(created_notification["ticket_id"])
-            
-            # Prepare notification response
-            notification_response = NotificationResponse(**notification_for_response)
+            # Prepare notification response (the model accepts the ObjectIds as-is)
+            notification_response = NotificationResponse(**notification_data)
             
             # Broadcast via WebSocket if user is connected
             if manager.is_user_connected(user_id):
-                # Convert to dict and ensure all ObjectIds are strings
-                websocket_data = notification_response.dict()
-                websocket_data["_id"] = str(notification_response.id)
-                websocket_data["id"] = str(notification_response.id)  # Add both _id and id for compatibility
-                
-                await manager.send_notification(
-                    websocket_data,
+                await manager.send_notification_text(
+                    NotificationService._websocket_payload(notification_data),
                     user_id
                 )
                 logger.info(f"Sent WebSocket notification to user {user_id}")
@@ -82,6 +115,45 @@ class NotificationService:
             logger.error(f"Error creating notification: {e}")
             raise
     
+    @staticmethod
+    def _websocket_payload(notification_doc: Dict[str, Any]) -> str:
+        """Serialize a notification document to the slim JSON pushed over WebSocket
+        
+        Clients identify notifications by ``id``; the full document (read state,
+        metadata) is available from the REST notifications endpoints.
+        """
+        return NotificationPush(**notification_doc).model_dump_json()
+    
+    @staticmethod
+    async def _bulk_create_notifications(notification_docs: List[Dict[str, Any]]) -> List[NotificationResponse]:
+        """Insert notifications in one batch and broadcast them to connected users"""
+        if not notification_docs:
+            return []
+        
+        db = get_database()
+        
+        # Client-generated ids let responses be built without reading the documents back
+        for doc in notification_docs:
+            doc["_id"] = ObjectId()
+        
+        await db.notifications.insert_many(notification_docs, ordered=False)
+        
+        notification_responses = [NotificationResponse(**doc) for doc in notification_docs]
+        
+        # Fan out to connected users concurrently
+        sends = []
+        for doc in notification_docs:
+            user_id = str(doc["user_id"])
+            if manager.is_user_connected(user_id):
+                sends.append(manager.send_notification_text(
+                    NotificationService._websocket_payload(doc),
+                    user_id
+                ))
+        await asyncio.gather(*sends)
+        
+        logger.info(f"Created {len(notification_docs)} notifications in bulk")
+        return notification_responses
+    
     @staticmethod
     async def create_ticket_notification(
         ticket_id: str,
@@ -89,28 +161,33 @@ class NotificationService:
         title: str,
         message: str,
         target_user_id: Optional[str] = None,
-        notify_all_admins: bool = False
+        notify_all_admins: bool = False,
+        admin_ids: Optional[List[str]] = None
     ):
-        """Create ticket-related notifications"""
+        """Create ticket-related notifications
+        
+        Callers that already know the admin/agent ids can pass ``admin_ids`` to
+        skip the lookup when ``notify_all_admins`` is set.
+        """
         try:
             db = get_database()
             
-            # Get ticket details
-            ticket = await db.tickets.find_one({"_id": ObjectId(ticket_id)})
+            # Get ticket details and, if needed, all admins and agents concurrently
+            ticket_oid = ObjectId(ticket_id)
+            ticket_query = db.tickets.find_one({"_id": ticket_oid}, _TICKET_PROJECTION)
+            if notify_all_admins and admin_ids is None:
+                ticket, admin_ids = await asyncio.gather(ticket_query, _get_admin_ids())
+            else:
+                ticket = await ticket_query
+                if not notify_all_admins:
+                    admin_ids = []
+            
             if not ticket:
                 logger.error(f"Ticket {ticket_id} not found")
                 return
             
-            # Determine who to notify
-            users_to_notify = []
-            
-            if notify_all_admins:
-                # Notify all admins and agents
-                admin_users = await db.users.find({
-                    "role": {"$in": ["admin", "agent"]},
-                    "is_active": True
-                }).to_list(None)
-                users_to_notify.extend([str(user["_id"]) for user in admin_users])
+            # Determine who to notify (copied, the admin id list is shared with the cache)
+            users_to_notify = list(admin_ids)
             
             if target_user_id:
                 users_to_notify.append(target_user_id)
@@ -119,58 +196,103 @@ class NotificationService:
             if not users_to_notify:
                 users_to_notify.append(str(ticket["created_by"]))
             
-            # Create notifications for each user
-            for user_id in set(users_to_notify):  # Remove duplicates
-                await NotificationService.create_and_broadcast_notification(
-                    user_id=user_id,
-                    notification_type=notification_type,
-                    title=title,
-                    message=message,
-                    data={
-                        "ticket_id": ticket_id,
-                        "ticket_title": ticket.get("title", ""),
-                        "ticket_status": ticket.get("status", ""),
-                        "ticket_priority": ticket.get("priority", "medium")
-                    },
-                    ticket_id=ticket_id
+            # Create notifications for all users in a single batch
+            created_at = datetime.utcnow()
+            notification_docs = [
+                NotificationService._ticket_notification_doc(
+                    user_id, ticket_oid, ticket, notification_type, title, message, created_at
                 )
+                for user_id in set(users_to_notify)  # Remove duplicates
+            ]
+            await NotificationService._bulk_create_notifications(notification_docs)
             
-            # Broadcast ticket update to connected users
-            ticket_data = {
-                "id": ticket_id,
-                "subject": ticket.get("title", ""),
-                "status": ticket.get("status", ""),
-                "priority": ticket.get("priority", "medium"),
-                "updated_at": datetime.utcnow().isoformat(),
-                "update_type": notification_type.value
-            }
-            
-            # Send to specific users and admins
-            await manager.send_ticket_update(ticket_data, users_to_notify)
+            # Send ticket update to specific users and admins
+            await manager.send_ticket_update(
+                NotificationService._ticket_update_data(ticket_id, ticket, notification_type),
+                users_to_notify
+            )
             
         except Exception as e:
             logger.error(f"Error creating ticket notification: {e}")
     
     @staticmethod
-    async def notify_new_ticket(ticket_id: str):
-        """Notify admins about a new ticket"""
-        try:
-            db = get_database()
-            
-            # Get ticket details with creator info
-            pipeline = [
-                {"$match": {"_id": ObjectId(ticket_id)}},
+    def _ticket_notification_doc(
+        user_id: str,
+        ticket_oid: ObjectId,
+        ticket: Dict[str, Any],
+        notification_type: NotificationType,
+        title: str,
+        message: str,
+        created_at: datetime
+    ) -> Dict[str, Any]:
+        """Build the notification document for one recipient of a ticket notification"""
+        return {
+            "user_id": ObjectId(user_id),
+            "notification_type": notification_type.value,
+            "title": title,
+            "message": message,
+            "data": {
+                "ticket_id": str(ticket_oid),
+                "ticket_title": ticket.get("title", ""),
+                "ticket_status": ticket.get("status", ""),
+                "ticket_priority": ticket.get("priority", "medium")
+            },
+            "ticket_id": ticket_oid,
+            "priority": "medium",
+            "is_read": False,
+            "read_at": None,
+            "created_at": created_at
+        }
+    
+    @staticmethod
+    def _ticket_update_data(ticket_id: str, ticket: Dict[str, Any], notification_type: NotificationType) -> Dict[str, Any]:
+        """Build the ticket_update WebSocket payload for a ticket notification"""
+        return {
+            "id": ticket_id,
+            "subject": ticket.get("title", ""),
+            "status": ticket.get("status", ""),
+            "priority": ticket.get("priority", "medium"),
+            "updated_at": datetime.utcnow().isoformat(),
+            "update_type": notification_type.value
+        }
+    
+    @staticmethod
+    async def _get_ticket_with_users(ticket_id: str, users: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """Fetch a ticket and related users (output field -> user id) in one aggregation"""
+        db = get_database()
+        
+        pipeline = [
+            {"$match": {"_id": ObjectId(ticket_id)}},
+            {"$project": _TICKET_PROJECTION}
+        ]
+        for field, user_id in users.items():
+            pipeline.extend([
                 {
                     "$lookup": {
                         "from": "users",
-                        "localField": "created_by",
-                        "foreignField": "_id",
-                        "as": "creator"
+                        "let": {"uid": ObjectId(user_id)},
+                        "pipeline": [
+                            {"$match": {"$expr": {"$eq": ["$_id", "$$uid"]}}},
+                            {"$project": _USER_PROJECTION}
+                        ],
+                        "as": field
                     }
-                }
-            ]
+                },
+                {"$unwind": {"path": f"${field}", "preserveNullAndEmptyArrays": True}}
+            ])
+        
+        result = await (await db.tickets.aggregate(pipeline)).to_list(1)
+        return result[0] if result else None
+    
+    @staticmethod
+    async def notify_new_ticket(ticket_id: str, admin_ids: Optional[List[str]] = None):
+        """Notify admins about a new ticket (``admin_ids`` skips the admin lookup)"""
+        try:
+            db = get_database()
             
-            ticket_cursor = db.tickets.aggregate(pipeline)
+            # Get ticket details with creator info
+            pipeline = NotificationService._new_ticket_pipeline({"_id": ObjectId(ticket_id)})
+            ticket_cursor = await db.tickets.aggregate(pipeline)
             ticket_data = await ticket_cursor.to_list(length=1)
             
             if not ticket_data:
@@ -179,9 +301,7 @@ class NotificationService:
             
             ticket = ticket_data[0]
             creator = ticket["creator"][0] if ticket["creator"] else {}
-            
-            title = f"New {ticket.get('priority', 'medium').title()} Priority Ticket"
-            message = f"New ticket '{ticket.get('title', '')}' submitted by {creator.get('full_name', 'Unknown User')}"
+            title, message = NotificationService._new_ticket_content(ticket, creator)
             
             # Create notifications for all admins/agents
             await NotificationService.create_ticket_notification(
@@ -189,38 +309,68 @@ class NotificationService:
                 notification_type=NotificationType.TICKET_CREATED,
                 title=title,
                 message=message,
-                notify_all_admins=True
+                notify_all_admins=True,
+                admin_ids=admin_ids
             )
             
             # Broadcast new ticket alert
-            ticket_alert_data = {
-                "id": ticket_id,
-                "title": ticket.get("title", ""),
-                "priority": ticket.get("priority", "medium"),
-                "status": ticket.get("status", ""),
-                "created_by": {
-                    "id": str(creator.get("_id", "")),
-                    "name": creator.get("full_name", "Unknown User"),
-                    "email": creator.get("email", "")
-                },
-                "created_at": ticket.get("created_at", datetime.utcnow()).isoformat()
-            }
-            
-            await manager.send_new_ticket_alert(ticket_alert_data)
+            await manager.send_new_ticket_alert(
+                NotificationService._new_ticket_alert_data(ticket_id, ticket, creator)
+            )
             
         except Exception as e:
             logger.error(f"Error notifying new ticket: {e}")
     
+    @staticmethod
+    def _new_ticket_pipeline(match: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Aggregation pipeline fetching new tickets with their creator's name and email"""
+        return [
+            {"$match": match},
+            {"$project": {"title": 1, "status": 1, "priority": 1, "created_by": 1, "created_at": 1}},
+            {
+                "$lookup": {
+                    "from": "users",
+                    "localField": "created_by",
+                    "foreignField": "_id",
+                    "pipeline": [{"$project": {"full_name": 1, "email": 1}}],
+                    "as": "creator"
+                }
+            }
+        ]
+    
+    @staticmethod
+    def _new_ticket_content(ticket: Dict[str, Any], creator: Dict[str, Any]) -> Tuple[str, str]:
+        """Notification title and message for a new ticket"""
+        title = f"New {ticket.get('priority', 'medium').title()} Priority Ticket"
+        message = f"New ticket '{ticket.get('title', '')}' submitted by {creator.get('full_name', 'Unknown User')}"
+        return title, message
+    
+    @staticmethod
+    def _new_ticket_alert_data(ticket_id: str, ticket: Dict[str, Any], creator: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the new_ticket WebSocket alert payload"""
+        return {
+            "id": ticket_id,
+            "title": ticket.get("title", ""),
+            "priority": ticket.get("priority", "medium"),
+            "status": ticket.get("status", ""),
+            "created_by": {
+                "id": str(creator.get("_id", "")),
+                "name": creator.get("full_name", "Unknown User"),
+                "email": creator.get("email", "")
+            },
+            "created_at": ticket.get("created_at", datetime.utcnow()).isoformat()
+        }
+    
     @staticmethod
     async def notify_ticket_assignment(ticket_id: str, assigned_to_id: str, assigned_by_id: str):
         """Notify about ticket assignment"""
         try:
-            db = get_database()
-            
-            # Get assignee and assigner details
-            assignee = await db.users.find_one({"_id": ObjectId(assigned_to_id)})
-            assigner = await db.users.find_one({"_id": ObjectId(assigned_by_id)})
-            ticket = await db.tickets.find_one({"_id": ObjectId(ticket_id)})
+            # Get ticket with assignee and assigner details
+            ticket = await NotificationService._get_ticket_with_users(
+                ticket_id, {"assignee": assigned_to_id, "assigner": assigned_by_id}
+            )
+            assignee = ticket.get("assignee") if ticket else None
+            assigner = ticket.get("assigner") if ticket else None
             
             if not all([assignee, assigner, ticket]):
                 logger.error("Missing data for ticket assignment notification")
@@ -247,6 +397,9 @@ class NotificationService:
                 },
                 ticket_id=ticket_id
             )
+            await NotificationService._send_ticket_update(
+                ticket_id, ticket, NotificationType.TICKET_ASSIGNED, [assigned_to_id]
+            )
             
         except Exception as e:
             logger.error(f"Error notifying ticket assignment: {e}")
@@ -255,10 +408,10 @@ class NotificationService:
     async def notify_ticket_status_change(ticket_id: str, old_status: str, new_status: str, updated_by_id: str):
         """Notify about ticket status changes"""
         try:
-            db = get_database()
-            
-            ticket = await db.tickets.find_one({"_id": ObjectId(ticket_id)})
-            updated_by = await db.users.find_one({"_id": ObjectId(updated_by_id)})
+            ticket = await NotificationService._get_ticket_with_users(
+                ticket_id, {"updated_by_user": updated_by_id}
+            )
+            updated_by = ticket.get("updated_by_user") if ticket else None
             
             if not all([ticket, updated_by]):
                 logger.error("Missing data for ticket status change notification")
@@ -268,7 +421,7 @@ class NotificationService:
             message = f"Ticket '{ticket.get('title', '')}' status changed from {old_status} to {new_status}"
             
             # Notify ticket creator
-            creator_id = str(ticket["created_by"])
+            creator_id = ticket["created_by"]
             await NotificationService.create_and_broadcast_notification(
                 user_id=creator_id,
                 notification_type=NotificationType.TICKET_STATUS_CHANGED,
@@ -285,13 +438,13 @@ class NotificationService:
                         "username": updated_by.get("username", "")
                     }
                 },
-                ticket_id=ticket_id
+                ticket_id=ticket["_id"]
             )
             
             # If ticket is assigned, also notify the assignee (if different from creator)
-            if ticket.get("assigned_to") and str(ticket["assigned_to"]) != creator_id:
+            if ticket.get("assigned_to") and ticket["assigned_to"] != creator_id:
                 await NotificationService.create_and_broadcast_notification(
-                    user_id=str(ticket["assigned_to"]),
+                    user_id=ticket["assigned_to"],
                     notification_type=NotificationType.TICKET_STATUS_CHANGED,
                     title=title,
                     message=message,
@@ -306,9 +459,16 @@ class NotificationService:
                             "username": updated_by.get("username", "")
                         }
                     },
-                    ticket_id=ticket_id
+                    ticket_id=ticket["_id"]
                 )
             
+            participants = [str(creator_id)]
+            if ticket.get("assigned_to"):
+                participants.append(str(ticket["assigned_to"]))
+            await NotificationService._send_ticket_update(
+                ticket_id, ticket, NotificationType.TICKET_STATUS_CHANGED, participants
+            )
+            
         except Exception as e:
             logger.error(f"Error notifying ticket status change: {e}")
     
@@ -316,10 +476,10 @@ class NotificationService:
     async def notify_ticket_resolved(ticket_id: str, resolved_by_id: str, resolution_note: Optional[str] = None):
         """Notify about ticket resolution"""
         try:
-            db = get_database()
-            
-            ticket = await db.tickets.find_one({"_id": ObjectId(ticket_id)})
-            resolved_by = await db.users.find_one({"_id": ObjectId(resolved_by_id)})
+            ticket = await NotificationService._get_ticket_with_users(
+                ticket_id, {"resolved_by_user": resolved_by_id}
+            )
+            resolved_by = ticket.get("resolved_by_user") if ticket else None
             
             if not all([ticket, resolved_by]):
                 logger.error("Missing data for ticket resolution notification")
@@ -333,7 +493,7 @@ class NotificationService:
             
             # Notify ticket creator
             await NotificationService.create_and_broadcast_notification(
-                user_id=str(ticket["created_by"]),
+                user_id=ticket["created_by"],
                 notification_type=NotificationType.TICKET_RESOLVED,
                 title=title,
                 message=message,
@@ -349,12 +509,28 @@ class NotificationService:
                         "username": resolved_by.get("username", "")
                     }
                 },
-                ticket_id=ticket_id,
+                ticket_id=ticket["_id"],
                 priority="high"
             )
+            await NotificationService._send_ticket_update(
+                ticket_id, ticket, NotificationType.TICKET_RESOLVED, [str(ticket["created_by"])]
+            )
             
         except Exception as e:
             logger.error(f"Error notifying ticket resolution: {e}")
+    
+    @staticmethod
+    async def _send_ticket_update(
+        ticket_id: str,
+        ticket: Dict[str, Any],
+        notification_type: NotificationType,
+        user_ids: List[str]
+    ):
+        """Push one ticket_update to the ticket's participants and room subscribers"""
+        await manager.send_ticket_update(
+            NotificationService._ticket_update_data(str(ticket_id), ticket, notification_type),
+            user_ids
+        )
 
 
 # Create service instance
@@ -0,0 +1,44 @@
+"""
+Short-lived ticket statistics cache shared by the ticket and admin routes
+"""
+
+import asyncio
+import time
+from typing import Optional, Tuple
+
+from app.models.ticket import TicketStats
+
+# Cache shared by polling dashboards: (computed_at, version, stats)
+_STATS_TTL_SECONDS = 10
+_stats_cache: Optional[Tuple[float, int, TicketStats]] = None
+_stats_version = 0
+
+# Only one request recomputes the stats; concurrent callers reuse its result
+stats_lock = asyncio.Lock()
+
+
+def invalidate_stats_cache() -> None:
+    """Mark cached ticket stats stale after a ticket write"""
+    global _stats_version
+    _stats_version += 1
+
+
+def stats_version() -> int:
+    """Current invalidation version, read before computing fresh stats"""
+    return _stats_version
+
+
+def get_cached_stats() -> Optional[TicketStats]:
+    """Return cached ticket stats if still fresh and not invalidated"""
+    if _stats_cache is None:
+        return None
+    computed_at, version, stats = _stats_cache
+    if version != _stats_version or time.monotonic() - computed_at > _STATS_TTL_SECONDS:
+        return None
+    return stats
+
+
+def cache_stats(stats: TicketStats, version: int) -> None:
+    """Store stats computed while ``version`` was current"""
+    global _stats_cache
+    _stats_cache = (time.monotonic(), version, stats)
@@ -2,36 +2,274 @@
 Authentication utilities for JWT tokens and password security
 """
 
+import asyncio
+import hashlib
+import logging
+import multiprocessing
 import secrets
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Union
+from typing import Dict, Optional, Tuple, Union
 from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import JWTError, jwt
+import jwt
+from jwt import PyJWTError as JWTError
 from passlib.context import CryptContext
 from bson import ObjectId
+from pymongo import UpdateOne
 
 from app.config import settings
 from app.database.connection import get_database
 from app.models.user import TokenData, UserResponse, UserRole
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger(__name__)
+
+# Password hashing context: new hashes use argon2id, existing bcrypt hashes still
+# verify and are upgraded on the next successful login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__time_cost=2,
+    argon2__memory_cost=65536,
+    argon2__parallelism=1
+)
+
+# Worker processes for password hashing, created on first use so bursts of
+# logins are spread across every core
+_password_pool: Optional[ProcessPoolExecutor] = None
 
 # HTTP Bearer token security
 security = HTTPBearer()
 
+# Short-lived cache of authenticated users: user_id -> (cached_at, user). It is per
+# process and invalidate_user_cache only clears the local worker, so the TTL bounds how
+# long other workers keep a suspended or demoted user; admins and agents are not cached
+_USER_CACHE_TTL_SECONDS = 5
+_USER_CACHE_MAX_SIZE = 10000
+_user_cache: Dict[str, Tuple[float, UserResponse]] = {}
+
+
+def _get_cached_user(user_id: str) -> Optional[UserResponse]:
+    """Return a cached user if the entry is still fresh"""
+    entry = _user_cache.get(user_id)
+    if entry is None:
+        return None
+    cached_at, user = entry
+    if time.monotonic() - cached_at > _USER_CACHE_TTL_SECONDS:
+        _user_cache.pop(user_id, None)
+        return None
+    return user
+
+
+def _cache_user(user_id: str, user: UserResponse) -> None:
+    """Store a user in the cache, evicting expired entries when it grows too large"""
+    now = time.monotonic()
+    if len(_user_cache) >= _USER_CACHE_MAX_SIZE:
+        expired = [uid for uid, (cached_at, _) in _user_cache.items() if now - cached_at > _USER_CACHE_TTL_SECONDS]
+        for uid in expired:
+            del _user_cache[uid]
+        if len(_user_cache) >= _USER_CACHE_MAX_SIZE:
+            _user_cache.clear()
+    _user_cache[user_id] = (now, user)
+
+
+def invalidate_user_cache(user_id: str) -> None:
+    """Drop a cached user after its profile, role, status or password changes"""
+    user_id = str(user_id)
+    _user_cache.pop(user_id, None)
+    # Tokens issued before the change carry stale claims until they are too old to trust
+    _stale_claims_until[user_id] = time.time() + _CLAIMS_MAX_AGE_SECONDS
+    stale_tokens = [key for key, (_, user) in _token_cache.items() if str(user.id) == user_id]
+    for key in stale_tokens:
+        del _token_cache[key]
+
+
+# Token claims are only trusted for this long after issue (the WebSocket token cache
+# TTL), which covers connecting right after login; older tokens and privileged roles
+# fall back to a database lookup, so suspensions and role changes apply on every worker
+# within this window, even though _stale_claims_until is per-process
+_CLAIMS_MAX_AGE_SECONDS = 30
+_CLAIMS_UNTRUSTED_ROLES = {UserRole.ADMIN.value, UserRole.AGENT.value}
+
+# Users whose profile changed since their current tokens were issued: user_id -> until
+_stale_claims_until: Dict[str, float] = {}
+
+
+def user_token_claims(user: dict) -> dict:
+    """JWT claims that let token holders be authenticated without a user lookup"""
+    return {
+        "sub": str(user["_id"]),
+        "email": user["email"],
+        "username": user["username"],
+        "full_name": user["full_name"],
+        "role": user["role"],
+        "status": user["status"],
+        "department": user.get("department"),
+        "created_at": user["created_at"].isoformat(),
+        "updated_at": user["updated_at"].isoformat()
+    }
+
+
+def user_from_token_claims(payload: dict) -> Optional[UserResponse]:
+    """Build a user from token claims, or None if they are missing or may be stale"""
+    user_id = payload.get("sub")
+    if not user_id or payload.get("status") != "active":
+        return None
+    if any(
+        payload.get(claim) is None
+        for claim in ("email", "username", "full_name", "role", "created_at", "updated_at")
+    ):
+        return None  # Token issued before these claims were added
+    if payload["role"] in _CLAIMS_UNTRUSTED_ROLES:
+        return None  # Admin/agent access is always checked against the database
+    issued_at = payload.get("iat")
+    if issued_at is None or time.time() - issued_at > _CLAIMS_MAX_AGE_SECONDS:
+        return None
+    stale_until = _stale_claims_until.get(user_id)
+    if stale_until is not None:
+        if time.time() < stale_until:
+            return None
+        del _stale_claims_until[user_id]
+    return UserResponse.model_validate({
+        "_id": user_id,
+        "email": payload["email"],
+        "username": payload["username"],
+        "full_name": payload["full_name"],
+        "role": payload["role"],
+        "status": payload["status"],
+        "department": payload.get("department"),
+        "created_at": payload["created_at"],
+        "updated_at": payload["updated_at"]
+    })
+
+
+# Verified WebSocket tokens: sha256(token) -> (expires_at, user), never outliving the token
+_TOKEN_CACHE_TTL_SECONDS = 30
+_TOKEN_CACHE_MAX_SIZE = 10000
+_token_cache: Dict[bytes, Tuple[float, UserResponse]] = {}
+
+
+def get_cached_token_user(token: str) -> Optional[UserResponse]:
+    """Return the user a token was recently verified for, if still fresh"""
+    key = hashlib.sha256(token.encode()).digest()
+    entry = _token_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, user = entry
+    if time.time() >= expires_at:
+        _token_cache.pop(key, None)
+        return None
+    return user
+
+
+def cache_token_user(token: str, user: UserResponse, token_exp: Optional[float] = None) -> None:
+    """Remember a successful token verification until the TTL or the token's exp"""
+    now = time.time()
+    expires_at = now + _TOKEN_CACHE_TTL_SECONDS
+    if token_exp is not None:
+        expires_at = min(expires_at, token_exp)
+    if expires_at <= now:
+        return
+    if len(_token_cache) >= _TOKEN_CACHE_MAX_SIZE:
+        expired = [key for key, (exp, _) in _token_cache.items() if exp <= now]
+        for key in expired:
+            del _token_cache[key]
+        if len(_token_cache) >= _TOKEN_CACHE_MAX_SIZE:
+            _token_cache.clear()
+    _token_cache[hashlib.sha256(token.encode()).digest()] = (expires_at, user)
+
+
+# Pending last_login timestamps (user_id -> time), written to MongoDB in batches
+LAST_LOGIN_FLUSH_INTERVAL_SECONDS = 30
+_pending_last_logins: Dict[str, datetime] = {}
+
+
+def record_last_login(user_id: str) -> None:
+    """Queue a last_login update for the next batched flush"""
+    _pending_last_logins[user_id] = datetime.utcnow()
+
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a plain password against its hash"""
+async def flush_last_logins() -> None:
+    """Write all pending last_login timestamps in a single bulk operation"""
+    if not _pending_last_logins:
+        return
+    
+    pending = _pending_last_logins.copy()
+    _pending_last_logins.clear()
+    
+    db = get_database()
+    await db.users.bulk_write(
+        [
+            UpdateOne({"_id": ObjectId(user_id)}, {"$set": {"last_login": last_login}})
+            for user_id, last_login in pending.items()
+        ],
+        ordered=False
+    )
+
+
+async def run_last_login_flusher() -> None:
+    """Periodically flush pending last_login updates until cancelled"""
+    while True:
+        await asyncio.sleep(LAST_LOGIN_FLUSH_INTERVAL_SECONDS)
+        try:
+            await flush_last_logins()
+        except Exception as e:
+            logger.error(f"Error flushing last_login updates: {e}")
+
+
+def _get_password_pool() -> ProcessPoolExecutor:
+    """Return the password hashing process pool, creating it on first use"""
+    global _password_pool
+    if _password_pool is None:
+        # The pool starts after the database and event loop threads exist, and forking
+        # a threaded process can deadlock, so workers come from a clean forkserver
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _password_pool = ProcessPoolExecutor(
+            max_workers=settings.password_hash_workers,
+            mp_context=multiprocessing.get_context(start_method)
+        )
+    return _password_pool
+
+
+def shutdown_password_pool() -> None:
+    """Stop the password hashing worker processes"""
+    global _password_pool
+    if _password_pool is not None:
+        _password_pool.shutdown(wait=False, cancel_futures=True)
+        _password_pool = None
+
+
+def _verify_password_sync(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password in a worker process (module-level so it can be pickled)"""
     return pwd_context.verify(plain_password, hashed_password)
 
 
-def get_password_hash(password: str) -> str:
-    """Hash a password"""
+def _hash_password_sync(password: str) -> str:
+    """Hash a password in a worker process (module-level so it can be pickled)"""
     return pwd_context.hash(password)
 
 
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Check whether a stored hash uses a deprecated scheme or outdated parameters"""
+    return pwd_context.needs_update(hashed_password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a plain password against its hash in the password process pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_password_pool(), _verify_password_sync, plain_password, hashed_password
+    )
+
+
+async def get_password_hash(password: str) -> str:
+    """Hash a password in the password process pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_password_pool(), _hash_password_sync, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token"""
     to_encode = data.copy()
@@ -77,6 +315,13 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     token = credentials.credentials
     token_data = verify_token(token)
     
+    # Update last login time (coalesced and written in the background)
+    record_last_login(token_data.user_id)
+    
+    cached_user = _get_cached_user(token_data.user_id)
+    if cached_user is not None:
+        return cached_user
+    
     db = get_database()
     user = await db.users.find_one({"_id": ObjectId(token_data.user_id)})
     
@@ -87,13 +332,10 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Update last login time
-    await db.users.update_one(
-        {"_id": ObjectId(token_data.user_id)},
-        {"$set": {"last_login": datetime.utcnow()}}
-    )
-    
-    return UserResponse(**user)
+    current_user = UserResponse(**user)
+    if current_user.role not in (UserRole.ADMIN, UserRole.AGENT):
+        _cache_user(token_data.user_id, current_user)
+    return current_user
 
 
 async def get_current_active_user(current_user: UserResponse = Depends(get_current_user)) -> UserResponse:
@@ -108,8 +350,11 @@ async def get_current_active_user(current_user: UserResponse = Depends(get_curre
 
 def require_role(required_roles: Union[UserRole, list[UserRole]]):
     """Decorator to require specific user roles"""
+    # Normalize once so each request does a single hash lookup
     if isinstance(required_roles, UserRole):
-        required_roles = [required_roles]
+        required_roles = frozenset((required_roles,))
+    else:
+        required_roles = frozenset(required_roles)
     
     def role_checker(current_user: UserResponse = Depends(get_current_active_user)) -> UserResponse:
         if current_user.role not in required_roles:
@@ -152,7 +397,7 @@ def validate_file_type(content_type: str) -> bool:
 async def check_ticket_permissions(ticket_id: str, current_user: UserResponse) -> bool:
     """Check if user has permission to access a ticket"""
     db = get_database()
-    ticket = await db.tickets.find_one({"_id": ObjectId(ticket_id)})
+    ticket = await db.tickets.find_one({"_id": ObjectId(ticket_id)}, {"created_by": 1})
     
     if not ticket:
         return False
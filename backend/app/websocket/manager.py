@@ -2,33 +2,160 @@
 WebSocket connection manager for real-time functionality
 """
 
-import json
+import asyncio
 import logging
-from typing import Dict, List, Set, Optional, Any
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Set, Optional, Any, Tuple, Union
 from fastapi import WebSocket, WebSocketDisconnect
 from bson import ObjectId
+import msgpack
+import orjson
 
 logger = logging.getLogger(__name__)
 
 
+def _json_default(obj: Any) -> Any:
+    """Serialize values orjson does not support natively (datetimes are handled by orjson)"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def encode(message: Dict[str, Any]) -> bytes:
+    """Serialize a WebSocket message to UTF-8 JSON bytes"""
+    return orjson.dumps(message, default=_json_default)
+
+
+def dumps(message: Dict[str, Any]) -> str:
+    """Serialize a WebSocket message to JSON text"""
+    return encode(message).decode()
+
+
+# WebSocket subprotocol clients request to receive MessagePack instead of JSON
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+
+def _msgpack_default(obj: Any) -> Any:
+    """Serialize values MessagePack does not support natively, matching the JSON output"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not MessagePack serializable")
+
+
+def pack(message: Union[Dict[str, Any], bytes, str]) -> bytes:
+    """Serialize a message dict, or an already JSON-encoded message, to MessagePack"""
+    if not isinstance(message, dict):
+        message = orjson.loads(message)
+    return msgpack.packb(message, default=_msgpack_default, use_bin_type=True)
+
+
+class OutgoingMessage:
+    """A message serialized lazily, at most once per wire format, however many sends share it
+    
+    Built from a message dict, or from JSON already serialized as bytes (encode()) or
+    text. MessagePack is packed from the dict when there is one, so pre-encoded JSON is
+    only parsed back when no dict is available, and then once rather than per send.
+    """
+    
+    __slots__ = ("_message", "_json", "_text", "_packed")
+    
+    def __init__(self, message: Union[Dict[str, Any], bytes, str]):
+        self._message = message if isinstance(message, dict) else None
+        self._json = message if isinstance(message, bytes) else None
+        self._text = message if isinstance(message, str) else None
+        self._packed = None
+    
+    @property
+    def json(self) -> bytes:
+        """UTF-8 JSON for binary-frame clients"""
+        if self._json is None:
+            self._json = self._text.encode() if self._text is not None else encode(self._message)
+        return self._json
+    
+    @property
+    def text(self) -> str:
+        """JSON text for text-frame clients"""
+        if self._text is None:
+            self._text = self.json.decode()
+        return self._text
+    
+    @property
+    def packed(self) -> bytes:
+        """MessagePack for clients that negotiated the msgpack subprotocol"""
+        if self._packed is None:
+            self._packed = pack(self._message if self._message is not None else self.json)
+        return self._packed
+    
+    def payload(self, binary: bool, use_msgpack: bool) -> Union[str, bytes]:
+        """The payload in a connection's format (str for text frames, bytes for binary)"""
+        if use_msgpack:
+            return self.packed
+        if binary:
+            return self.json
+        return self.text
+
+
+# A message dict, JSON already serialized with encode() (or as text), or an OutgoingMessage
+Message = Union[Dict[str, Any], bytes, str, OutgoingMessage]
+
+
+def _as_outgoing(message: Message) -> OutgoingMessage:
+    """Wrap a message so every send sharing it reuses the same serialized payloads"""
+    return message if isinstance(message, OutgoingMessage) else OutgoingMessage(message)
+
+
+def ticket_room(ticket_id: str) -> str:
+    """Room name for subscribers of a single ticket"""
+    return f"ticket:{ticket_id}"
+
+
 class ConnectionManager:
     """Manager for WebSocket connections with user and admin segregation"""
     
     def __init__(self):
         # Store active connections by user ID
         self.active_connections: Dict[str, WebSocket] = {}
-        # Store admin connections separately for admin-specific broadcasts
-        self.admin_connections: Set[str] = set()
+        # Store admin/agent sockets separately for admin-specific broadcasts
+        self.admin_connections: Dict[str, WebSocket] = {}
         # Store user roles for proper routing
         self.user_roles: Dict[str, str] = {}
+        # Users whose clients asked for UTF-8 JSON in binary frames instead of text frames
+        self.binary_connections: Set[str] = set()
+        # Users whose clients negotiated the MessagePack subprotocol
+        self.msgpack_connections: Set[str] = set()
+        # Room subscriptions (room -> user IDs) and the reverse index for cleanup
+        self.rooms: Dict[str, Set[str]] = defaultdict(set)
+        self.user_rooms: Dict[str, Set[str]] = defaultdict(set)
     
-    async def connect(self, websocket: WebSocket, user_id: str, user_role: str):
+    async def connect(
+        self,
+        websocket: WebSocket,
+        user_id: str,
+        user_role: str,
+        binary: bool = False,
+        use_msgpack: bool = False
+    ):
         """Accept and store a WebSocket connection (legacy method)"""
-        await websocket.accept()
-        await self.register_connection(websocket, user_id, user_role)
+        await websocket.accept(subprotocol=MSGPACK_SUBPROTOCOL if use_msgpack else None)
+        await self.register_connection(websocket, user_id, user_role, binary, use_msgpack)
     
-    async def register_connection(self, websocket: WebSocket, user_id: str, user_role: str):
-        """Register a WebSocket connection (connection should already be accepted)"""
+    async def register_connection(
+        self,
+        websocket: WebSocket,
+        user_id: str,
+        user_role: str,
+        binary: bool = False,
+        use_msgpack: bool = False
+    ):
+        """Register a WebSocket connection (connection should already be accepted)
+        
+        With ``binary`` the client receives each JSON message as a binary frame,
+        which skips the per-recipient text encode; browsers should keep text frames.
+        With ``use_msgpack`` messages are sent as MessagePack binary frames instead.
+        """
         # If user already connected, disconnect old connection first
         if user_id in self.active_connections:
             logger.info(f"User {user_id} already connected, replacing connection")
@@ -42,74 +169,127 @@ class ConnectionManager:
         self.user_roles[user_id] = user_role
         
         if user_role in ["admin", "agent"]:
-            self.admin_connections.add(user_id)
+            self.admin_connections[user_id] = websocket
+        else:
+            self.admin_connections.pop(user_id, None)
+        
+        if binary:
+            self.binary_connections.add(user_id)
+        else:
+            self.binary_connections.discard(user_id)
+        
+        if use_msgpack:
+            self.msgpack_connections.add(user_id)
+        else:
+            self.msgpack_connections.discard(user_id)
         
         logger.info(f"User {user_id} ({user_role}) registered via WebSocket")
     
-    def disconnect(self, user_id: str):
-        """Remove a WebSocket connection"""
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-        if user_id in self.admin_connections:
-            self.admin_connections.remove(user_id)
-        if user_id in self.user_roles:
-            del self.user_roles[user_id]
+    def disconnect(self, user_id: str, websocket: Optional[WebSocket] = None):
+        """Remove a WebSocket connection
+        
+        When ``websocket`` is given, the user is only unregistered if that socket is
+        still their current connection, so cleanup of a replaced connection cannot
+        drop the newer one.
+        """
+        if websocket is not None and self.active_connections.get(user_id) is not websocket:
+            return
+        
+        self.active_connections.pop(user_id, None)
+        self.admin_connections.pop(user_id, None)
+        self.user_roles.pop(user_id, None)
+        self.binary_connections.discard(user_id)
+        self.msgpack_connections.discard(user_id)
+        
+        for room in self.user_rooms.pop(user_id, ()):
+            self._leave_room(user_id, room)
         
         logger.info(f"User {user_id} disconnected from WebSocket")
     
-    async def send_personal_message(self, message: Dict[str, Any], user_id: str):
-        """Send a message to a specific user"""
-        if user_id in self.active_connections:
-            try:
-                websocket = self.active_connections[user_id]
-                # Check if websocket is still open
-                if websocket.client_state.name == "CONNECTED":
-                    await websocket.send_text(json.dumps(message))
-                else:
-                    logger.warning(f"WebSocket for user {user_id} is not connected, removing")
-                    self.disconnect(user_id)
-            except Exception as e:
-                logger.error(f"Error sending message to user {user_id}: {e}")
-                # Remove disconnected connection
-                self.disconnect(user_id)
+    def subscribe(self, user_id: str, room: str):
+        """Subscribe a user to a room"""
+        self.rooms[room].add(user_id)
+        self.user_rooms[user_id].add(room)
     
-    async def broadcast_to_admins(self, message: Dict[str, Any]):
-        """Send a message to all connected admins and agents"""
-        disconnected_users = []
-        
-        for user_id in self.admin_connections.copy():  # Use copy to avoid modification during iteration
-            if user_id in self.active_connections:
-                try:
-                    websocket = self.active_connections[user_id]
-                    if websocket.client_state.name == "CONNECTED":
-                        await websocket.send_text(json.dumps(message))
-                    else:
-                        disconnected_users.append(user_id)
-                except Exception as e:
-                    logger.error(f"Error broadcasting to admin {user_id}: {e}")
-                    disconnected_users.append(user_id)
-        
-        # Clean up disconnected users
-        for user_id in disconnected_users:
-            self.disconnect(user_id)
+    def unsubscribe(self, user_id: str, room: str):
+        """Unsubscribe a user from a room"""
+        self._leave_room(user_id, room)
+        rooms = self.user_rooms.get(user_id)
+        if rooms is not None:
+            rooms.discard(room)
+            if not rooms:
+                del self.user_rooms[user_id]
+    
+    def _leave_room(self, user_id: str, room: str):
+        """Remove a user from a room's members, dropping the room once empty"""
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(user_id)
+            if not members:
+                del self.rooms[room]
     
-    async def broadcast_to_all(self, message: Dict[str, Any]):
-        """Send a message to all connected users"""
-        disconnected_users = []
+    async def send_personal(self, message: Message, user_id: str):
+        """Send a message (dict or pre-encoded JSON) to a specific user in their format"""
+        websocket = self.active_connections.get(user_id)
+        if websocket is None:
+            return
+        payload = _as_outgoing(message).payload(
+            user_id in self.binary_connections, user_id in self.msgpack_connections
+        )
+        if not await self._write(user_id, websocket, payload):
+            self.disconnect(user_id, websocket)
+    
+    @staticmethod
+    async def _write(user_id: str, websocket: WebSocket, payload: Union[str, bytes]) -> bool:
+        """Send bytes as a binary frame and str as a text frame; False if the connection is dead
         
-        for user_id, websocket in self.active_connections.copy().items():  # Use copy to avoid modification during iteration
-            try:
-                if websocket.client_state.name == "CONNECTED":
-                    await websocket.send_text(json.dumps(message))
+        Kept to a single coroutine per recipient, since broadcasts create one per socket.
+        """
+        try:
+            if websocket.client_state.name == "CONNECTED":
+                if isinstance(payload, bytes):
+                    await websocket.send_bytes(payload)
                 else:
-                    disconnected_users.append(user_id)
-            except Exception as e:
-                logger.error(f"Error broadcasting to user {user_id}: {e}")
-                disconnected_users.append(user_id)
+                    await websocket.send_text(payload)
+                return True
+            logger.warning(f"WebSocket for user {user_id} is not connected, removing")
+        except Exception as e:
+            logger.error(f"Error sending message to user {user_id}: {e}")
+        return False
+    
+    async def _broadcast(self, targets: Iterable[Tuple[str, WebSocket]], message: Message):
+        """Send a message to (user_id, websocket) pairs concurrently and drop dead connections
+        
+        ``targets`` may iterate the live connection dicts: it is consumed before the
+        first await, and disconnects are only applied once every send has finished.
+        """
+        # Serialize at most once per wire format and share that payload across recipients
+        outgoing = _as_outgoing(message)
+        binary = self.binary_connections
+        msgpack_users = self.msgpack_connections
+        recipients: List[Tuple[str, WebSocket]] = []
+        sends = []
+        for user_id, websocket in targets:
+            payload = outgoing.payload(user_id in binary, user_id in msgpack_users)
+            recipients.append((user_id, websocket))
+            sends.append(self._write(user_id, websocket, payload))
         
-        # Clean up disconnected users
-        for user_id in disconnected_users:
-            self.disconnect(user_id)
+        if not sends:
+            return
+        results = await asyncio.gather(*sends)
+        
+        # Clean up disconnected users (unless they reconnected while we were sending)
+        for (user_id, websocket), sent in zip(recipients, results):
+            if not sent:
+                self.disconnect(user_id, websocket)
+    
+    async def broadcast_to_admins(self, message: Message):
+        """Send a message (dict or pre-encoded JSON) to all connected admins and agents"""
+        await self._broadcast(self.admin_connections.items(), message)
+    
+    async def broadcast_to_all(self, message: Message):
+        """Send a message (dict or pre-encoded JSON) to all connected users"""
+        await self._broadcast(self.active_connections.items(), message)
     
     async def send_notification(self, notification_data: Dict[str, Any], target_user_id: str):
         """Send a notification to a specific user"""
@@ -117,7 +297,11 @@ class ConnectionManager:
             "type": "notification",
             "data": notification_data
         }
-        await self.send_personal_message(message, target_user_id)
+        await self.send_personal(message, target_user_id)
+    
+    async def send_notification_text(self, notification_json: str, target_user_id: str):
+        """Send a notification whose data is already serialized to JSON"""
+        await self.send_personal(f'{{"type":"notification","data":{notification_json}}}', target_user_id)
     
     async def send_ticket_update(self, ticket_data: Dict[str, Any], user_ids: List[str] = None):
         """Send ticket update to relevant users"""
@@ -127,9 +311,16 @@ class ConnectionManager:
         }
         
         if user_ids:
-            # Send to specific users
-            for user_id in user_ids:
-                await self.send_personal_message(message, user_id)
+            # Send once to each participant or room subscriber (a set, so users
+            # who are both receive a single copy)
+            recipients = set(user_ids)
+            recipients.update(self.rooms.get(ticket_room(ticket_data.get("id")), ()))
+            targets = (
+                (user_id, self.active_connections[user_id])
+                for user_id in recipients
+                if user_id in self.active_connections
+            )
+            await self._broadcast(targets, message)
         else:
             # Broadcast to all admins/agents
             await self.broadcast_to_admins(message)
@@ -142,6 +333,16 @@ class ConnectionManager:
         }
         await self.broadcast_to_admins(message)
     
+    @property
+    def user_count(self) -> int:
+        """Number of connected users (dict length, so O(1))"""
+        return len(self.active_connections)
+    
+    @property
+    def admin_count(self) -> int:
+        """Number of connected admins and agents (dict length, so O(1))"""
+        return len(self.admin_connections)
+    
     def get_connected_users(self) -> List[str]:
         """Get list of connected user IDs"""
         return list(self.active_connections.keys())
@@ -156,12 +357,14 @@ class ConnectionManager:
     
     def get_connection_info(self) -> Dict[str, Any]:
         """Get detailed connection information"""
+        total = self.user_count
+        admins = self.admin_count
         return {
-            "total_connections": len(self.active_connections),
-            "admin_connections": len(self.admin_connections),
-            "customer_connections": len(self.active_connections) - len(self.admin_connections),
-            "connected_users": list(self.active_connections.keys()),
-            "connected_admins": list(self.admin_connections),
+            "total_connections": total,
+            "admin_connections": admins,
+            "customer_connections": total - admins,
+            "connected_users": self.get_connected_users(),
+            "connected_admins": self.get_connected_admins(),
             "user_roles": self.user_roles.copy()
         }
 
@@ -2,30 +2,184 @@
 WebSocket routes for real-time functionality
 """
 
-import json
+import asyncio
 import logging
+import re
 from datetime import datetime
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Query
-from jose import JWTError, jwt
+from typing import Any, Dict, Optional, Union
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query
+import jwt
+import msgpack
+import orjson
+from jwt import PyJWTError as JWTError
 from bson import ObjectId
 
 from app.config import settings
 from app.models.user import UserResponse, UserRole
-from app.websocket.manager import manager
+from app.utils.auth import (
+    check_ticket_permissions, get_cached_token_user, cache_token_user, user_from_token_claims
+)
+from app.websocket.manager import manager, ticket_room, encode, pack, MSGPACK_SUBPROTOCOL
 from app.database.connection import get_database
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Frames buffered between the socket reader task and the message handler
+_RECEIVE_QUEUE_SIZE = 128
+
+# How long mark_notification_read messages are collected before one batched update
+_READ_FLUSH_DELAY_SECONDS = 0.05
+
+# Fixed parts of outbound frames, so only the variable fields are serialized per send
+_PONG_PREFIX = b'{"type":"pong","timestamp":'
+_ERROR_PREFIX = b'{"type":"error","data":'
+_CONNECTION_ESTABLISHED_PREFIX = b'{"type":"connection_established","data":'
+_FRAME_SUFFIX = b'}'
+# The same frames for MessagePack clients, packed from a dict: prefix -> (type, value key)
+_FRAME_FIELDS = {
+    _PONG_PREFIX: ("pong", "timestamp"),
+    _ERROR_PREFIX: ("error", "data"),
+    _CONNECTION_ESTABLISHED_PREFIX: ("connection_established", "data")
+}
+_INTERNAL_ERROR = {"message": "Internal server error", "code": 500}
+
+# Compact heartbeat frames ({"type":"ping",...}) are answered by swapping the type;
+# only an optional numeric timestamp may follow, anything else takes the parsed path
+_COMPACT_PING_PATTERN = r'\{"type":"ping"(?:,"timestamp":-?\d{1,20}(?:\.\d{1,9})?)?\}'
+_COMPACT_PING_TEXT = re.compile(_COMPACT_PING_PATTERN)
+_COMPACT_PING_BYTES = re.compile(_COMPACT_PING_PATTERN.encode())
+_PING_TEXT_PREFIX = '{"type":"ping"'
+_PONG_TEXT_PREFIX = '{"type":"pong"'
+_PING_BYTES_PREFIX = _PING_TEXT_PREFIX.encode()
+_PONG_BYTES_PREFIX = _PONG_TEXT_PREFIX.encode()
+
+
+class WSAuthError(Exception):
+    """WebSocket authentication failure, reported to the client before closing"""
+    
+    def __init__(self, code: int, detail: str):
+        super().__init__(detail)
+        self.code = code
+        self.detail = detail
+
+
+def _encode_frame(prefix: bytes, value: Any, binary: bool, use_msgpack: bool) -> Union[str, bytes]:
+    """Serialize a templated frame as MessagePack, binary or text JSON, matching the client"""
+    if use_msgpack:
+        frame_type, key = _FRAME_FIELDS[prefix]
+        return pack({"type": frame_type, key: value})
+    frame = prefix + encode(value) + _FRAME_SUFFIX
+    return frame if binary else frame.decode()
+
+
+async def _write_frame(websocket: WebSocket, payload: Union[str, bytes]):
+    """Send bytes as a binary frame and str as a text frame"""
+    if isinstance(payload, bytes):
+        await websocket.send_bytes(payload)
+    else:
+        await websocket.send_text(payload)
+
+
+async def _send_frame(websocket: WebSocket, prefix: bytes, value: Any, binary: bool, use_msgpack: bool = False):
+    """Send a templated frame (prefix + value) in the client's format"""
+    await _write_frame(websocket, _encode_frame(prefix, value, binary, use_msgpack))
+
+
+async def _receive_frame(websocket: WebSocket) -> Union[str, bytes]:
+    """Receive a text or binary frame, returning binary payloads without decoding them"""
+    frame = await websocket.receive()
+    if frame["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(frame.get("code", 1000))
+    data = frame.get("bytes")
+    return data if data is not None else frame["text"]
+
+
+async def _read_frames(websocket: WebSocket, frames: asyncio.Queue, binary: bool, use_msgpack: bool):
+    """Push raw frames onto ``frames`` until the socket fails; the final error is queued too"""
+    try:
+        while True:
+            if use_msgpack:
+                frame = await websocket.receive_bytes()
+            elif binary:
+                # Binary-frame clients may also send JSON as binary frames, which
+                # skips the server's UTF-8 text decode; orjson parses the bytes directly
+                frame = await _receive_frame(websocket)
+            else:
+                frame = await websocket.receive_text()
+            await frames.put(frame)
+    except Exception as e:
+        await frames.put(e)
+
+
+async def _handle_frame(
+    websocket: WebSocket,
+    data: Union[str, bytes],
+    current_user: UserResponse,
+    read_batcher: "NotificationReadBatcher",
+    binary: bool,
+    use_msgpack: bool
+):
+    """Handle one incoming client frame"""
+    if use_msgpack:
+        message = msgpack.unpackb(data)
+    else:
+        # Answer compact pings without parsing; the pong echoes the timestamp
+        if isinstance(data, bytes):
+            if _COMPACT_PING_BYTES.fullmatch(data):
+                await websocket.send_bytes(_PONG_BYTES_PREFIX + data[len(_PING_BYTES_PREFIX):])
+                return
+        elif _COMPACT_PING_TEXT.fullmatch(data):
+            pong = _PONG_TEXT_PREFIX + data[len(_PING_TEXT_PREFIX):]
+            if binary:
+                await websocket.send_bytes(pong.encode())
+            else:
+                await websocket.send_text(pong)
+            return
+        
+        message = orjson.loads(data)
+    
+    # Valid JSON/MessagePack that is not an object (numbers, lists, strings) is ignored
+    if not isinstance(message, dict):
+        logger.debug(f"Ignoring non-object WebSocket message from {current_user.username}")
+        return
+    logger.debug(f"Received WebSocket message from {current_user.username}: {message.get('type')}")
+    
+    # Handle ping/pong for connection health (pings with other formatting)
+    if message.get("type") == "ping":
+        try:
+            pong = _encode_frame(_PONG_PREFIX, message.get("timestamp"), binary, use_msgpack)
+        except (TypeError, ValueError, OverflowError):
+            # Timestamps the encoder rejects (over 64-bit ints, msgpack bytes) are not echoed
+            pong = _encode_frame(_PONG_PREFIX, None, binary, use_msgpack)
+        await _write_frame(websocket, pong)
+    
+    # Handle message read receipts
+    elif message.get("type") == "mark_notification_read":
+        notification_id = message.get("notification_id")
+        if notification_id:
+            read_batcher.add(notification_id)
+    
+    # Handle ticket room subscriptions
+    elif message.get("type") == "subscribe_ticket":
+        ticket_id = message.get("ticket_id")
+        if ticket_id:
+            await handle_ticket_subscribe(ticket_id, current_user)
+    
+    elif message.get("type") == "unsubscribe_ticket":
+        ticket_id = message.get("ticket_id")
+        if ticket_id:
+            manager.unsubscribe(str(current_user.id), ticket_room(ticket_id))
+
 
 async def get_current_user_websocket(token: str) -> UserResponse:
     """Get current user from WebSocket token parameter"""
     try:
-        # Validate token format first
-        if not token or token.count('.') != 2:
-            logger.error(f"Invalid JWT token format: expected 3 segments, got {token.count('.') + 1 if token else 0}")
-            raise HTTPException(status_code=401, detail="Invalid token format")
+        # Reconnects with a recently verified token skip the decode and user lookup
+        cached_user = get_cached_token_user(token)
+        if cached_user is not None:
+            return cached_user
         
         # Decode JWT token
         payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
@@ -33,7 +187,13 @@ async def get_current_user_websocket(token: str) -> UserResponse:
         
         if user_id is None:
             logger.error("No user ID found in JWT token")
-            raise HTTPException(status_code=401, detail="Invalid token")
+            raise WSAuthError(401, "Invalid token")
+        
+        # Tokens carrying the user's claims need no database round-trip
+        claims_user = user_from_token_claims(payload)
+        if claims_user is not None:
+            cache_token_user(token, claims_user, payload.get("exp"))
+            return claims_user
         
         # Get user from database
         db = get_database()
@@ -47,46 +207,72 @@ async def get_current_user_websocket(token: str) -> UserResponse:
         
         if user is None:
             logger.error(f"User {user_id} not found in database")
-            raise HTTPException(status_code=404, detail="User not found")
+            raise WSAuthError(404, "User not found")
         
         # Check user status (not is_active)
         if user.get("status") != "active":
             logger.error(f"User {user_id} is not active (status: {user.get('status')})")
-            raise HTTPException(status_code=400, detail="Inactive user")
+            raise WSAuthError(400, "Inactive user")
         
-        # Convert ObjectId fields to strings for response
-        user_data = user.copy()
-        user_data["_id"] = str(user["_id"])
-        if user_data.get("department"):
-            user_data["department"] = str(user_data["department"])
-        
-        return UserResponse(**user_data)
+        # Build the response from just the fields it uses (no copy of the document)
+        # and validate it in one call into the compiled validator
+        current_user = UserResponse.model_validate({
+            "_id": user["_id"],
+            "username": user["username"],
+            "email": user["email"],
+            "full_name": user["full_name"],
+            "role": user["role"],
+            "status": user["status"],
+            "phone": user.get("phone"),
+            "department": str(user["department"]) if user.get("department") else None,
+            "avatar_url": user.get("avatar_url"),
+            "created_at": user["created_at"],
+            "updated_at": user["updated_at"],
+            "last_login": user.get("last_login")
+        })
+        cache_token_user(token, current_user, payload.get("exp"))
+        return current_user
         
+    except WSAuthError:
+        raise
+    except jwt.InvalidSignatureError as e:
+        # Subclass of DecodeError: forged or wrong-key tokens are invalid credentials
+        logger.error(f"JWT error: {e}")
+        raise WSAuthError(401, "Invalid token")
+    except jwt.DecodeError as e:
+        # Malformed tokens (wrong segment count, bad encoding) are rejected by the decoder
+        logger.error(f"Invalid JWT token format: {e}")
+        raise WSAuthError(401, "Invalid token format")
     except JWTError as e:
         logger.error(f"JWT error: {e}")
-        raise HTTPException(status_code=401, detail="Invalid token")
+        raise WSAuthError(401, "Invalid token")
     except Exception as e:
         logger.error(f"Unexpected error in websocket auth: {e}")
-        raise HTTPException(status_code=500, detail="Authentication error")
+        raise WSAuthError(500, "Authentication error")
 
 
 @router.websocket("/connect")
 async def websocket_endpoint(
     websocket: WebSocket,
-    token: str = Query(..., description="JWT token for authentication")
+    token: str = Query(..., description="JWT token for authentication"),
+    binary: bool = Query(False, description="Exchange messages as UTF-8 JSON in binary frames")
 ):
     """
     WebSocket endpoint for real-time notifications and updates
     Requires authentication via JWT token in query parameter
+    Clients requesting the "msgpack" subprotocol exchange MessagePack binary frames
     """
     current_user = None
     connection_accepted = False
+    use_msgpack = False
+    read_batcher = None
     
     try:
         logger.info(f"WebSocket connection attempt with token: {token[:20]}..." if token else "No token")
         
-        # Accept the WebSocket connection first (ASGI requirement)
-        await websocket.accept()
+        # Accept the WebSocket connection first (ASGI requirement), negotiating MessagePack
+        use_msgpack = MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", ())
+        await websocket.accept(subprotocol=MSGPACK_SUBPROTOCOL if use_msgpack else None)
         connection_accepted = True
         logger.debug("WebSocket connection accepted")
         
@@ -94,71 +280,58 @@ async def websocket_endpoint(
         try:
             current_user = await get_current_user_websocket(token)
             logger.info(f"WebSocket authentication successful for user: {current_user.username} ({current_user.role})")
-        except HTTPException as auth_error:
+        except WSAuthError as auth_error:
             logger.error(f"WebSocket authentication failed: {auth_error.detail}")
             # Send authentication error and close connection properly
-            await websocket.send_text(json.dumps({
-                "type": "error",
-                "data": {
-                    "message": auth_error.detail,
-                    "code": auth_error.status_code
-                }
-            }))
+            await _send_frame(websocket, _ERROR_PREFIX, {
+                "message": auth_error.detail,
+                "code": auth_error.code
+            }, binary, use_msgpack)
             await websocket.close(code=1008)  # Policy violation
             return
         
         # Register user with connection manager
-        await manager.register_connection(websocket, str(current_user.id), current_user.role.value)
+        await manager.register_connection(
+            websocket, str(current_user.id), current_user.role.value, binary, use_msgpack
+        )
         logger.info(f"WebSocket connection registered for user: {current_user.username}")
+        read_batcher = NotificationReadBatcher(current_user)
         
         # Send connection confirmation
-        await websocket.send_text(json.dumps({
-            "type": "connection_established",
-            "data": {
-                "user_id": str(current_user.id),
-                "username": current_user.username,
-                "role": current_user.role.value,
-                "message": "WebSocket connection established successfully"
-            }
-        }))
+        await _send_frame(websocket, _CONNECTION_ESTABLISHED_PREFIX, {
+            "user_id": str(current_user.id),
+            "username": current_user.username,
+            "role": current_user.role.value,
+            "message": "WebSocket connection established successfully"
+        }, binary, use_msgpack)
         
+        # Frames are read by a background task and handled in batches, so reads keep
+        # flowing while a handler awaits the database
+        frames: asyncio.Queue = asyncio.Queue(maxsize=_RECEIVE_QUEUE_SIZE)
+        reader = asyncio.create_task(_read_frames(websocket, frames, binary, use_msgpack))
         try:
             # Keep connection alive and handle incoming messages
             while True:
-                data = await websocket.receive_text()
-                message = json.loads(data)
-                logger.debug(f"Received WebSocket message from {current_user.username}: {message.get('type')}")
+                batch = [await frames.get()]
+                while not frames.empty():
+                    batch.append(frames.get_nowait())
                 
-                # Handle ping/pong for connection health
-                if message.get("type") == "ping":
-                    await websocket.send_text(json.dumps({
-                        "type": "pong",
-                        "timestamp": message.get("timestamp")
-                    }))
-                
-                # Handle message read receipts
-                elif message.get("type") == "mark_notification_read":
-                    notification_id = message.get("notification_id")
-                    if notification_id:
-                        await handle_notification_read(notification_id, current_user)
+                for data in batch:
+                    if isinstance(data, Exception):
+                        raise data
+                    await _handle_frame(websocket, data, current_user, read_batcher, binary, use_msgpack)
                 
         except WebSocketDisconnect:
             logger.info(f"WebSocket disconnected for user: {current_user.username if current_user else 'Unknown'}")
+        finally:
+            reader.cancel()
             
     except Exception as e:
-        logger.error(f"WebSocket connection error: {e}")
-        import traceback
-        logger.error(f"WebSocket traceback: {traceback.format_exc()}")
+        logger.exception(f"WebSocket connection error: {e}")
         
         if connection_accepted:
             try:
-                await websocket.send_text(json.dumps({
-                    "type": "error", 
-                    "data": {
-                        "message": "Internal server error",
-                        "code": 500
-                    }
-                }))
+                await _send_frame(websocket, _ERROR_PREFIX, _INTERNAL_ERROR, binary, use_msgpack)
                 await websocket.close(code=1011)  # Internal error
             except Exception as close_error:
                 logger.error(f"Error closing WebSocket after exception: {close_error}")
@@ -167,22 +340,58 @@ async def websocket_endpoint(
         # Clean up connection
         try:
             if current_user:
-                manager.disconnect(str(current_user.id))
+                manager.disconnect(str(current_user.id), websocket)
+                if read_batcher is not None:
+                    await read_batcher.close()
                 logger.info(f"WebSocket cleanup completed for user: {current_user.username}")
         except Exception as cleanup_error:
             logger.error(f"Error during WebSocket cleanup: {cleanup_error}")
 
 
-async def handle_notification_read(notification_id: str, current_user: UserResponse):
-    """Handle marking notification as read via WebSocket"""
+class NotificationReadBatcher:
+    """Coalesce a connection's mark_notification_read messages into batched updates"""
+    
+    def __init__(self, current_user: UserResponse):
+        self.current_user = current_user
+        self.pending: Dict[str, ObjectId] = {}
+        self.flush_task: Optional[asyncio.Task] = None
+    
+    def add(self, notification_id: str):
+        """Queue a notification to be marked as read with the rest of its burst"""
+        if not ObjectId.is_valid(notification_id):
+            logger.error(f"Error marking notification as read: invalid id {notification_id}")
+            return
+        self.pending[notification_id] = ObjectId(notification_id)
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_later())
+    
+    async def _flush_later(self):
+        await asyncio.sleep(_READ_FLUSH_DELAY_SECONDS)
+        self.flush_task = None
+        await self.flush()
+    
+    async def flush(self):
+        """Write all queued read receipts now"""
+        if self.pending:
+            pending, self.pending = self.pending, {}
+            await handle_notifications_read(pending, self.current_user)
+    
+    async def close(self):
+        """Write any outstanding read receipts when the connection ends"""
+        if self.flush_task is not None:
+            await self.flush_task
+        await self.flush()
+
+
+async def handle_notifications_read(notification_ids: Dict[str, ObjectId], current_user: UserResponse):
+    """Mark a batch of notifications (id string -> ObjectId) as read via WebSocket"""
     try:
-        from bson import ObjectId
         db = get_database()
         
-        # Update notification as read
-        await db.notifications.update_one(
+        # Update notifications as read
+        await db.notifications.update_many(
             {
-                "_id": ObjectId(notification_id),
+                "_id": {"$in": list(notification_ids.values())},
                 "user_id": ObjectId(current_user.id)
             },
             {
@@ -193,16 +402,42 @@ async def handle_notification_read(notification_id: str, current_user: UserRespo
             }
         )
         
-        # Send confirmation back to user
-        await manager.send_personal_message({
+        # Send one confirmation for the whole batch back to user
+        await manager.send_personal({
             "type": "notification_read_confirmed",
             "data": {
-                "notification_id": notification_id
+                "notification_ids": list(notification_ids)
+            }
+        }, str(current_user.id))
+        
+    except Exception as e:
+        logger.error(f"Error marking notifications as read: {e}")
+
+
+async def handle_ticket_subscribe(ticket_id: str, current_user: UserResponse):
+    """Subscribe the user to updates for a ticket they are allowed to see"""
+    try:
+        if not ObjectId.is_valid(ticket_id) or not await check_ticket_permissions(ticket_id, current_user):
+            await manager.send_personal({
+                "type": "error",
+                "data": {
+                    "message": "Ticket not found or access denied",
+                    "ticket_id": ticket_id
+                }
+            }, str(current_user.id))
+            return
+        
+        manager.subscribe(str(current_user.id), ticket_room(ticket_id))
+        
+        await manager.send_personal({
+            "type": "ticket_subscribed",
+            "data": {
+                "ticket_id": ticket_id
             }
         }, str(current_user.id))
         
     except Exception as e:
-        logger.error(f"Error marking notification as read: {e}")
+        logger.error(f"Error subscribing to ticket: {e}")
 
 
 @router.get("/stats")
@@ -211,5 +446,5 @@ async def get_websocket_stats():
     return {
         "connected_users": manager.get_connected_users(),
         "connected_admins": manager.get_connected_admins(),
-        "total_connections": len(manager.get_connected_users())
+        "total_connections": manager.user_count
     } 
\ No newline at end of file
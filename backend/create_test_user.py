@@ -5,7 +5,7 @@ Create a test user for debugging
 
 import asyncio
 from datetime import datetime
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import AsyncMongoClient
 from app.config import settings
 from app.utils.auth import get_password_hash
 
@@ -13,7 +13,7 @@ from app.utils.auth import get_password_hash
 async def create_test_user():
     """Create a test user"""
     try:
-        client = AsyncIOMotorClient(settings.mongodb_url)
+        client = AsyncMongoClient(settings.mongodb_url)
         db = client[settings.database_name]
         
         email = "test@example.com"
@@ -22,7 +22,7 @@ async def create_test_user():
         print(f"🔧 Creating/updating test user: {email}")
         
         # Hash the password
-        password_hash = get_password_hash(password)
+        password_hash = await get_password_hash(password)
         
         # Create user data
         user_data = {
@@ -40,29 +40,23 @@ async def create_test_user():
             "avatar_url": None
         }
         
-        # Delete existing user if exists
-        await db.users.delete_many({"email": email})
+        # Create or replace the user in a single atomic write
+        result = await db.users.replace_one({"email": email}, user_data, upsert=True)
         
-        # Insert new user
-        result = await db.users.insert_one(user_data)
-        
-        print(f"✅ Created test user with ID: {result.inserted_id}")
+        if result.upserted_id is not None:
+            print(f"✅ Created test user with ID: {result.upserted_id}")
+        else:
+            print(f"✅ Replaced existing test user ({result.matched_count} matched)")
         print(f"📧 Email: {email}")
         print(f"🔑 Password: {password}")
         print(f"🎭 Role: customer")
         
-        # Verify the user was created correctly
-        created_user = await db.users.find_one({"email": email})
-        if created_user:
-            print(f"\n✅ Verification successful:")
-            print(f"  Username: {created_user.get('username')}")
-            print(f"  Full Name: {created_user.get('full_name')}")
-            print(f"  Role: {created_user.get('role')}")
-            print(f"  Status: {created_user.get('status')}")
-            print(f"  Has Password Hash: {'password_hash' in created_user}")
-        
     except Exception as e:
         print(f"❌ Error creating test user: {e}")
+    finally:
+        # Close database connection
+        if 'client' in locals():
+            await client.close()
 
 
 if __name__ == "__main__":
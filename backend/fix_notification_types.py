@@ -13,9 +13,12 @@ from typing import Dict
 # Add the backend directory to the Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import AsyncMongoClient, UpdateOne
 from app.config import settings
 
+# Number of updates sent per bulk_write when streaming notifications
+BATCH_SIZE = 1000
+
 
 async def fix_notification_types() -> None:
     """Fix invalid notification types in the database."""
@@ -41,28 +44,26 @@ async def fix_notification_types() -> None:
     
     try:
         # Connect to MongoDB
-        client = AsyncIOMotorClient(settings.mongodb_url)
+        client = AsyncMongoClient(settings.mongodb_url)
         db = client[settings.database_name]
         
         print("🔍 Checking for notifications with invalid types...")
         
-        # Find all notifications with invalid notification_type values
-        invalid_notifications = await db.notifications.find({
-            "notification_type": {"$in": list(type_fixes.keys())}
-        }).to_list(None)
+        # Count notifications with invalid notification_type values per type on the server
+        type_count_cursor = await db.notifications.aggregate([
+            {"$match": {"notification_type": {"$in": list(type_fixes.keys())}}},
+            {"$group": {"_id": "$notification_type", "n": {"$sum": 1}}}
+        ])
+        type_counts = {doc["_id"]: doc["n"] async for doc in type_count_cursor}
+        invalid_count = sum(type_counts.values())
         
-        print(f"📊 Found {len(invalid_notifications)} notifications with invalid types")
+        print(f"📊 Found {invalid_count} notifications with invalid types")
         
-        if not invalid_notifications:
+        if not invalid_count:
             print("✅ No invalid notification types found. Database is clean!")
             return
         
         # Show what will be fixed
-        type_counts = {}
-        for notification in invalid_notifications:
-            old_type = notification.get("notification_type", "unknown")
-            type_counts[old_type] = type_counts.get(old_type, 0) + 1
-        
         print("\n📋 Types to be fixed:")
         for old_type, count in type_counts.items():
             new_type = type_fixes.get(old_type, "system_alert")
@@ -74,73 +75,104 @@ async def fix_notification_types() -> None:
             print("❌ Operation cancelled.")
             return
         
-        # Fix each invalid type
+        # Fix every invalid type in one pipeline update, stamping all updates with
+        # the same migration time
         total_updated = 0
+        migrated_at = datetime.utcnow()
         
-        for old_type, new_type in type_fixes.items():
-            print(f"\n🔧 Fixing {old_type} → {new_type}...")
-            
-            # Update notification_type and set appropriate frontend type
-            frontend_type = frontend_type_mapping.get(new_type, "system")
-            
-            result = await db.notifications.update_many(
-                {"notification_type": old_type},
+        print("\n🔧 Fixing " + ", ".join(f"{old} → {new}" for old, new in type_fixes.items()) + "...")
+        
+        # Update notification_type and set the matching frontend type
+        result = await db.notifications.update_many(
+            {"notification_type": {"$in": list(type_fixes.keys())}},
+            [
                 {
                     "$set": {
-                        "notification_type": new_type,
-                        "type": frontend_type,
-                        "updated_at": datetime.utcnow()
+                        "notification_type": {
+                            "$switch": {
+                                "branches": [
+                                    {"case": {"$eq": ["$notification_type", old_type]}, "then": new_type}
+                                    for old_type, new_type in type_fixes.items()
+                                ],
+                                "default": "$notification_type"
+                            }
+                        },
+                        "type": {
+                            "$switch": {
+                                "branches": [
+                                    {
+                                        "case": {"$eq": ["$notification_type", old_type]},
+                                        "then": frontend_type_mapping.get(new_type, "system")
+                                    }
+                                    for old_type, new_type in type_fixes.items()
+                                ],
+                                "default": "system"
+                            }
+                        },
+                        "updated_at": migrated_at
                     }
                 }
-            )
-            
-            if result.modified_count > 0:
-                print(f"✅ Updated {result.modified_count} notifications")
-                total_updated += result.modified_count
-            else:
-                print(f"ℹ️  No notifications found with type '{old_type}'")
+            ]
+        )
+        
+        if result.modified_count > 0:
+            print(f"✅ Updated {result.modified_count} notifications")
+            total_updated += result.modified_count
+        else:
+            print("ℹ️  No notifications found with invalid types")
         
         # Also fix any notifications with missing or invalid frontend 'type' field
         print(f"\n🔧 Fixing missing frontend type fields...")
         
-        # Find notifications without proper frontend type
-        notifications_missing_type = await db.notifications.find({
-            "$or": [
-                {"type": {"$exists": False}},
-                {"type": ""},
-                {"type": None}
-            ]
-        }).to_list(None)
-        
-        for notification in notifications_missing_type:
+        # Stream notifications without proper frontend type and fix them in batches
+        missing_type_fixed = 0
+        operations = []
+        async for notification in db.notifications.find(
+            {
+                "$or": [
+                    {"type": {"$exists": False}},
+                    {"type": ""},
+                    {"type": None}
+                ]
+            },
+            projection={"notification_type": 1}
+        ):
             notification_type = notification.get("notification_type", "system_alert")
             frontend_type = frontend_type_mapping.get(notification_type, "system")
             
-            await db.notifications.update_one(
+            operations.append(UpdateOne(
                 {"_id": notification["_id"]},
                 {
                     "$set": {
                         "type": frontend_type,
-                        "updated_at": datetime.utcnow()
+                        "updated_at": migrated_at
                     }
                 }
-            )
+            ))
+            if len(operations) >= BATCH_SIZE:
+                await db.notifications.bulk_write(operations, ordered=False)
+                missing_type_fixed += len(operations)
+                operations = []
+        
+        if operations:
+            await db.notifications.bulk_write(operations, ordered=False)
+            missing_type_fixed += len(operations)
         
-        if notifications_missing_type:
-            print(f"✅ Fixed {len(notifications_missing_type)} notifications with missing frontend types")
-            total_updated += len(notifications_missing_type)
+        if missing_type_fixed:
+            print(f"✅ Fixed {missing_type_fixed} notifications with missing frontend types")
+            total_updated += missing_type_fixed
         
         print(f"\n🎉 Successfully updated {total_updated} notifications!")
         print("✅ All notification types are now valid and compatible with the enum validation.")
         
         # Verify the fix
         print("\n🔍 Verifying fix...")
-        remaining_invalid = await db.notifications.find({
+        remaining_invalid = await db.notifications.count_documents({
             "notification_type": {"$in": list(type_fixes.keys())}
-        }).to_list(None)
+        })
         
         if remaining_invalid:
-            print(f"⚠️  Warning: {len(remaining_invalid)} notifications still have invalid types")
+            print(f"⚠️  Warning: {remaining_invalid} notifications still have invalid types")
         else:
             print("✅ Verification passed: No invalid notification types remain")
         
@@ -150,7 +182,7 @@ async def fix_notification_types() -> None:
     finally:
         # Close database connection
         if 'client' in locals():
-            client.close()
+            await client.close()
 
 
 async def main() -> None:
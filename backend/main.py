@@ -3,16 +3,18 @@ Help Desk System Backend
 FastAPI application with MongoDB integration
 """
 
+import asyncio
 import os
 import uvicorn
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
 
 from app.config import settings
 from app.database.connection import init_database, close_database
+from app.utils.auth import run_last_login_flusher, flush_last_logins, shutdown_password_pool
 from app.routes import auth, tickets, users, chat, notifications, admin
 from app.websocket import routes as websocket_routes
 
@@ -21,6 +23,7 @@ async def lifespan(app: FastAPI):
     """Handle application startup and shutdown events"""
     # Startup
     await init_database()
+    last_login_flusher = asyncio.create_task(run_last_login_flusher())
     print("🚀 Help Desk API started successfully!")
     print(f"📚 Database: {settings.database_name}")
     print(f"🌐 Server: http://{settings.host}:{settings.port}")
@@ -28,6 +31,13 @@ async def lifespan(app: FastAPI):
     yield
     
     # Shutdown
+    last_login_flusher.cancel()
+    try:
+        await last_login_flusher
+    except asyncio.CancelledError:
+        pass
+    await flush_last_logins()
+    shutdown_password_pool()
     await close_database()
     print("👋 Help Desk API shutdown complete!")
 
@@ -39,6 +49,7 @@ app = FastAPI(
     docs_url="/api/docs",
     redoc_url="/api/redoc",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     redirect_slashes=True  # Enable automatic redirects for trailing slashes
 )
 
@@ -67,12 +78,6 @@ app.include_router(notifications.router, prefix="/api/notifications", tags=["Not
 app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
 app.include_router(websocket_routes.router, prefix="/ws", tags=["WebSocket"])
 
-# Add specific redirect for notifications without trailing slash
-@app.get("/api/notifications")
-async def redirect_notifications():
-    """Redirect notifications without slash to proper endpoint"""
-    return RedirectResponse(url="/api/notifications/", status_code=307)
-
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -99,5 +104,9 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=int(os.getenv("PORT", 8000)),
         reload=settings.debug,
-        log_level="info"
+        log_level="info",
+        # "auto" uses uvloop and httptools when installed (uvloop is not on Windows)
+        loop="auto",
+        http="auto",
+        ws="websockets"
     ) 
\ No newline at end of file
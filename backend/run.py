@@ -19,5 +19,9 @@ if __name__ == "__main__":
         port=settings.port,
         reload=settings.debug,
         log_level="info",
-        access_log=True
+        access_log=True,
+        # "auto" uses uvloop and httptools when installed (uvloop is not on Windows)
+        loop="auto",
+        http="auto",
+        ws="websockets"
     ) 
\ No newline at end of file
@@ -2,23 +2,110 @@
 """
 Test script to verify WebSocket functionality
 Run this while the backend server is running
+
+Usage: python3 test_websocket_live.py [--json] [ticket_count]
+
+With --json each step is reported as one JSON log line instead of the console text.
+
+The script runs on the deployed Python (3.11). For timing runs with a large
+ticket_count, a CPython 3.13 built with --enable-experimental-jit can be used
+with the JIT switched on: PYTHON_JIT=1 python3.13 test_websocket_live.py 1000
 """
 
 import asyncio
-import json
 import logging
+import sys
 from datetime import datetime
-from bson import ObjectId
+import bson
+from bson.raw_bson import RawBSONDocument
+import orjson
+
+# Attributes every LogRecord has; anything else on a record came from ``extra``
+_RECORD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message"}
+
+
+class JSONFormatter(logging.Formatter):
+    """Format log records as one orjson-encoded JSON object per line"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage()
+        }
+        entry.update((key, value) for key, value in record.__dict__.items() if key not in _RECORD_ATTRS)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-async def test_websocket_notifications():
-    """Test WebSocket notification system"""
+# Set by --json: report steps as structured log lines for harnesses scraping the output
+_json_output = False
+
+# Direct broadcast frame encoded once; only the timestamp is spliced in per run
+_TEST_BROADCAST_PREFIX, _TEST_BROADCAST_SUFFIX = orjson.dumps({
+    "type": "system_alert",
+    "data": {
+        "title": "🚀 Direct WebSocket Test",
+        "message": "This is a direct WebSocket broadcast test",
+        "timestamp": "__TIMESTAMP__",
+        "priority": "info"
+    }
+}).split(b"__TIMESTAMP__")
+
+# Fixed fields of every test ticket; the title, creator and timestamps are added per ticket
+_TEST_TICKET_TEMPLATE = {
+    "description": "This is a test ticket to verify WebSocket notifications",
+    "category": "technical",
+    "priority": "medium",
+    "status": "open",
+    "assigned_to": None,
+    "resolved_at": None,
+    "resolution_note": None,
+    "message_count": 0,
+    "attachments": [],
+    "tags": ["test", "websocket"]
+}
+
+# User lookup filters, BSON-encoded once so each query sends the bytes as-is
+_ADMIN_FILTER = RawBSONDocument(bson.encode({"role": {"$in": ["admin", "agent"]}, "status": "active"}))
+_CUSTOMER_FILTER = RawBSONDocument(bson.encode({"role": "customer", "status": "active"}))
+
+# Only the user fields the test prints or sends
+_USER_PROJECTION = {"_id": 1, "full_name": 1, "username": 1}
+
+
+async def _find_admins(db):
+    """Stream the active admins/agents, returning the first document and all ID strings"""
+    first_admin = None
+    admin_ids = []
+    async for admin in db.users.find(_ADMIN_FILTER, projection=_USER_PROJECTION):
+        if first_admin is None:
+            first_admin = admin
+        admin_ids.append(str(admin["_id"]))
+    return first_admin, admin_ids
+
+
+def _write_lines(*lines: str):
+    """Write a whole step's output to stdout in a single call"""
+    sys.stdout.write("\n".join(lines) + "\n")
+
+
+def _report(stage: int, lines: tuple, **fields):
+    """Report a step as console text, or as one JSON log line with --json"""
+    if _json_output:
+        logger.info("ws_test", extra={"stage": stage, **fields})
+    else:
+        _write_lines(*lines)
+
+async def test_websocket_notifications(ticket_count: int = 1):
+    """Test WebSocket notification system, creating ``ticket_count`` test tickets"""
     
-    print("🔧 Testing WebSocket Notification System")
-    print("=" * 50)
+    if not _json_output:
+        _write_lines("🔧 Testing WebSocket Notification System", "=" * 50)
     
     try:
         # Import and initialize database
@@ -33,122 +120,174 @@ async def test_websocket_notifications():
         from app.websocket.manager import manager
         
         # 1. Check current WebSocket connections
-        print("\n1. Current WebSocket Connections:")
         connection_info = manager.get_connection_info()
-        print(f"   Total connections: {connection_info['total_connections']}")
-        print(f"   Admin connections: {connection_info['admin_connections']}")
-        print(f"   Connected users: {connection_info['connected_users']}")
-        print(f"   Connected admins: {connection_info['connected_admins']}")
-        
+        lines = (
+            "\n1. Current WebSocket Connections:",
+            f"   Total connections: {connection_info['total_connections']}",
+            f"   Admin connections: {connection_info['admin_connections']}",
+            f"   Connected users: {connection_info['connected_users']}",
+            f"   Connected admins: {connection_info['connected_admins']}"
+        )
+        if connection_info['total_connections'] == 0:
+            lines += (
+                "   ❌ No WebSocket connections found!",
+                "   💡 Make sure users are logged in with WebSocket connections established",
+                "   💡 Check that the frontend is running and users have established WebSocket connections"
+            )
+        _report(
+            1, lines,
+            total_connections=connection_info["total_connections"],
+            admin_connections=connection_info["admin_connections"]
+        )
         if connection_info['total_connections'] == 0:
-            print("   ❌ No WebSocket connections found!")
-            print("   💡 Make sure users are logged in with WebSocket connections established")
-            print("   💡 Check that the frontend is running and users have established WebSocket connections")
             return
         
-        # 2. Find an admin user to test with
-        print("\n2. Finding Admin Users:")
-        admin_users = await db.users.find({
-            "role": {"$in": ["admin", "agent"]},
-            "is_active": True
-        }).to_list(None)
+        # Look up the admins (step 2) and a customer (step 4) concurrently
+        (test_admin, admin_ids), customer_user = await asyncio.gather(
+            _find_admins(db),
+            db.users.find_one(_CUSTOMER_FILTER, projection=_USER_PROJECTION)
+        )
         
-        if not admin_users:
-            print("   ❌ No admin users found!")
+        # 2. Find an admin user to test with
+        if test_admin is None:
+            _report(2, ("\n2. Finding Admin Users:", "   ❌ No admin users found!"), admins=0)
             return
         
-        test_admin = admin_users[0]
-        admin_id = str(test_admin["_id"])
-        print(f"   Found admin: {test_admin.get('full_name', test_admin['username'])} ({admin_id})")
+        admin_id = admin_ids[0]
         
         # Check if this admin is connected
         is_connected = manager.is_user_connected(admin_id)
-        print(f"   Admin WebSocket connected: {'✅ Yes' if is_connected else '❌ No'}")
+        _report(
+            2,
+            (
+                "\n2. Finding Admin Users:",
+                f"   Found admin: {test_admin.get('full_name', test_admin['username'])} ({admin_id})",
+                f"   Admin WebSocket connected: {'✅ Yes' if is_connected else '❌ No'}"
+            ),
+            admins=len(admin_ids), admin_id=admin_id, admin_connected=is_connected
+        )
         
         # 3. Create a test notification
-        print("\n3. Creating Test Notification:")
+        # One clock read and ISO string shared by the notification, tickets and broadcast
+        now = datetime.utcnow()
+        now_iso = now.isoformat()
         
         notification = await NotificationService.create_and_broadcast_notification(
-            user_id=admin_id,
+            user_id=test_admin["_id"],
             notification_type=NotificationType.SYSTEM_ALERT,
             title="🧪 WebSocket Test Notification",
-            message=f"Test notification sent at {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC",
+            message=f"Test notification sent at {now.isoformat(' ', 'seconds')} UTC",
             data={
                 "test": True,
-                "timestamp": datetime.utcnow().isoformat(),
+                "timestamp": now_iso,
                 "source": "test_websocket_live.py"
             },
             priority="high"
         )
         
-        print(f"   ✅ Notification created: {notification.id}")
-        print(f"   📨 WebSocket broadcast: {'Sent' if is_connected else 'User not connected'}")
+        _report(
+            3,
+            (
+                "\n3. Creating Test Notification:",
+                f"   ✅ Notification created: {notification.id}",
+                f"   📨 WebSocket broadcast: {'Sent' if is_connected else 'User not connected'}"
+            ),
+            notification_id=notification.id, sent=is_connected
+        )
         
         # 4. Test ticket creation notification
-        print("\n4. Testing Ticket Creation Notification:")
-        
-        # Find a customer user for ticket creation
-        customer_user = await db.users.find_one({"role": "customer", "is_active": True})
+        # Use the customer found during setup for ticket creation
         if customer_user:
-            customer_id = str(customer_user["_id"])
-            print(f"   Found customer: {customer_user.get('full_name', customer_user['username'])}")
+            customer_oid = customer_user["_id"]
             
-            # Create a test ticket
-            test_ticket = {
-                "title": "🧪 Test Ticket for WebSocket",
-                "description": "This is a test ticket to verify WebSocket notifications",
-                "category": "technical",
-                "priority": "medium", 
-                "created_by": ObjectId(customer_id),
-                "status": "open",
-                "assigned_to": None,
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow(),
-                "resolved_at": None,
-                "resolution_note": None,
-                "message_count": 0,
-                "attachments": [],
-                "tags": ["test", "websocket"]
-            }
+            # Create the test tickets in a single batch
+            test_tickets = [
+                {
+                    **_TEST_TICKET_TEMPLATE,
+                    "title": f"🧪 Test Ticket for WebSocket #{i + 1}",
+                    "created_by": customer_oid,
+                    "created_at": now,
+                    "updated_at": now
+                }
+                for i in range(ticket_count)
+            ]
             
-            result = await db.tickets.insert_one(test_ticket)
-            ticket_id = str(result.inserted_id)
-            print(f"   ✅ Test ticket created: {ticket_id}")
+            result = await db.tickets.insert_many(test_tickets, ordered=False)
             
-            # Trigger notification
-            await NotificationService.notify_new_ticket(ticket_id)
-            print(f"   📨 New ticket notifications sent to {len(admin_users)} admins")
+            # Trigger the notifications for every ticket concurrently
+            await asyncio.gather(*(
+                NotificationService.notify_new_ticket(str(ticket_id), admin_ids=admin_ids)
+                for ticket_id in result.inserted_ids
+            ))
+            _report(
+                4,
+                (
+                    "\n4. Testing Ticket Creation Notification:",
+                    f"   Found customer: {customer_user.get('full_name', customer_user['username'])}",
+                    f"   ✅ Test tickets created: {len(result.inserted_ids)}",
+                    f"   📨 New ticket notifications sent to {len(admin_ids)} admins"
+                ),
+                tickets=len(result.inserted_ids), admins=len(admin_ids)
+            )
             
         else:
-            print("   ❌ No customer users found for ticket test")
+            _report(
+                4,
+                ("\n4. Testing Ticket Creation Notification:", "   ❌ No customer users found for ticket test"),
+                tickets=0
+            )
         
         # 5. Test direct WebSocket broadcast
-        print("\n5. Testing Direct WebSocket Broadcast:")
-        
-        test_message = {
-            "type": "system_alert",
-            "data": {
-                "title": "🚀 Direct WebSocket Test",
-                "message": "This is a direct WebSocket broadcast test",
-                "timestamp": datetime.utcnow().isoformat(),
-                "priority": "info"
-            }
-        }
-        
-        await manager.broadcast_to_admins(test_message)
-        print(f"   ✅ Direct broadcast sent to {connection_info['admin_connections']} admin connections")
+        # The frame is pre-encoded at import; the manager sends these bytes to
+        # binary-frame clients and a single decoded copy to text-frame clients
+        await manager.broadcast_to_admins(_TEST_BROADCAST_PREFIX + now_iso.encode() + _TEST_BROADCAST_SUFFIX)
+        _report(
+            5,
+            (
+                "\n5. Testing Direct WebSocket Broadcast:",
+                f"   ✅ Direct broadcast sent to {connection_info['admin_connections']} admin connections"
+            ),
+            admin_connections=connection_info["admin_connections"]
+        )
         
         # 6. Summary
-        print("\n6. Test Summary:")
-        print("   ✅ WebSocket manager is operational")
-        print(f"   ✅ {connection_info['total_connections']} active connections")
-        print("   ✅ Notifications can be created and sent")
-        print("   ✅ Direct WebSocket broadcasts work")
-        print("\n💡 Check the frontend console for received messages!")
+        _report(
+            6,
+            (
+                "\n6. Test Summary:",
+                "   ✅ WebSocket manager is operational",
+                f"   ✅ {connection_info['total_connections']} active connections",
+                "   ✅ Notifications can be created and sent",
+                "   ✅ Direct WebSocket broadcasts work",
+                "\n💡 Check the frontend console for received messages!"
+            ),
+            ok=True
+        )
         
     except Exception as e:
-        print(f"\n❌ Error during WebSocket testing: {e}")
+        if not _json_output:
+            _write_lines(f"\n❌ Error during WebSocket testing: {e}")
         logger.exception("WebSocket test failed")
 
 if __name__ == "__main__":
-    asyncio.run(test_websocket_notifications()) 
\ No newline at end of file
+    # Use uvloop when available (it is not on Windows); fall back to the default loop
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    args = sys.argv[1:]
+    if "--json" in args:
+        args.remove("--json")
+        _json_output = True
+        handler = logging.StreamHandler()
+        handler.setFormatter(JSONFormatter())
+        logging.basicConfig(level=logging.INFO, handlers=[handler])
+    else:
+        logging.basicConfig(level=logging.INFO)
+    
+    # Optional argument: number of test tickets to create (default 1)
+    ticket_count = int(args[0]) if args else 1
+    if ticket_count < 1:
+        sys.exit("Usage: python3 test_websocket_live.py [--json] [ticket_count >= 1]")
+    asyncio.run(test_websocket_notifications(ticket_count)) 
\ No newline at end of file